@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MyReferralsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'my_referrals'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,220 @@
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.core.validators import validate_email
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import StatelessJWTAuthentication
+from .cache import aget_code_by_email, ainvalidate_user_codes
+from .hashers import acheck_password, run_hashing
+from .models import ReferralCode, User
+from .pagination import ReferralCursorPagination
+from .routers import apin_to_primary
+from .serializers import ReferralCodeSerializer, ReferralListSerializer, UserSerializer
+from .throttling import IPTokenBucketThrottle, UserTokenBucketThrottle
+
+
+def parse_json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class AsyncThrottleMixin:
+    """
+    Applies throttle_classes to async views the way DRF does, before the handler
+    (and so any query or password hash) runs.
+    """
+    throttle_classes = []
+    throttle_scope = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not await throttle.aallow_request(request, self):
+                wait = math.ceil(throttle.wait())
+                return JsonResponse({"detail": f"Request was throttled. Expected available in {wait} seconds."},
+                                    status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(wait)})
+        return await super().dispatch(request, *args, **kwargs)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncUserRegisterView(AsyncThrottleMixin, View):
+    """
+    ASGI-native version of UserRegisterView.
+    Takes new user's username, password and (optionally) email and referral code
+    and creates a new user object. The password is hashed on the hashing pool, as
+    in AsyncUserLoginView, and the rest of the registration runs in a worker thread.
+    """
+    throttle_classes = [IPTokenBucketThrottle]
+    throttle_scope = 'register'
+
+    async def post(self, request):
+        data = parse_json_body(request)
+        if data is None:
+            return JsonResponse({"error": "Request body must be a JSON object!"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = UserSerializer(data=data)
+        try:
+            serializer.is_valid(raise_exception=True)
+            encoded_password = await run_hashing(make_password, serializer.validated_data['password'])
+            user = await sync_to_async(serializer.save)(encoded_password=encoded_password)
+            await apin_to_primary(user.id, user.referrer_id)
+            return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+        except IntegrityError:
+            return JsonResponse({"error": "User with this username already exists!"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncUserLoginView(AsyncThrottleMixin, View):
+    """
+    ASGI-native version of UserLoginView.
+    Takes user's username and password and returns JWT access token and refresh token.
+    Password hashing runs on the hashing pool (PASSWORD_HASHING['OFFLOAD']), so slow
+    hashes don't hold up other requests served by the event loop.
+    """
+    throttle_classes = [IPTokenBucketThrottle]
+    throttle_scope = 'login'
+
+    async def post(self, request):
+        data = parse_json_body(request)
+        if data is None:
+            return JsonResponse({"error": "Request body must be a JSON object!"}, status=status.HTTP_400_BAD_REQUEST)
+        username = data.get('username')
+        password = data.get('password')
+
+        user = None
+        if isinstance(username, str) and isinstance(password, str):
+            user = await User.objects.filter(username=username).afirst()
+            if user is None:
+                # Hash anyway, so response time does not reveal whether the username exists.
+                await run_hashing(make_password, password)
+            elif not (await acheck_password(user, password) and user.is_active):
+                user = None
+
+        if user is None:
+            return JsonResponse({"detail": "Unable to log in with provided credentials!"},
+                                status=status.HTTP_401_UNAUTHORIZED)
+
+        user.last_login = timezone.now()
+        await user.asave(update_fields=['last_login'])
+        refresh = RefreshToken.for_user(user)
+        return JsonResponse({
+            "status": status.HTTP_200_OK,
+            "access_token": str(refresh.access_token),
+            "refresh_token": str(refresh)
+        })
+
+
+class AsyncJWTAuthenticationMixin:
+    """
+    Authenticates async views with the JWT access token the same way
+    StatelessJWTAuthentication does for DRF views, and renders DRF API
+    exceptions raised by the handlers as JSON.
+    """
+    authentication_class = StatelessJWTAuthentication
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            authenticated = await self.authentication_class().aauthenticate(request)
+            if authenticated is None:
+                return JsonResponse({"detail": "Authentication credentials were not provided."},
+                                    status=status.HTTP_401_UNAUTHORIZED)
+            request.user, request.auth = authenticated
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as e:
+            return JsonResponse({"detail": e.detail}, status=e.status_code)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncReferralCodeView(AsyncJWTAuthenticationMixin, View):
+    """
+    ASGI-native version of ReferralCodeView.
+    Requires user's JWT access token.
+    GET request: returns user's referral code.
+    POST request: creates a new referral code (replaces old one if it existed).
+    DELETE request: deletes user's referral code.
+    """
+    async def get(self, request):
+        try:
+            code = await ReferralCode.objects.aget(user_id=request.user.id)
+        except ReferralCode.DoesNotExist:
+            return JsonResponse({"detail": "Referral code not found"}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(ReferralCodeSerializer(code).data, status=status.HTTP_200_OK)
+
+    async def post(self, request):
+        new_code = await ReferralCode.objects.arotate(request.user.id)
+        await apin_to_primary(request.user.id)
+        await ainvalidate_user_codes(request.user.id)
+        return JsonResponse(ReferralCodeSerializer(new_code).data, status=status.HTTP_201_CREATED)
+
+    async def delete(self, request):
+        if not await ReferralCode.objects.adiscard(request.user.id):
+            return JsonResponse({"detail": "Referral code not found"}, status=status.HTTP_404_NOT_FOUND)
+        await apin_to_primary(request.user.id)
+        await ainvalidate_user_codes(request.user.id)
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+class AsyncReferralCodeByEmailView(AsyncJWTAuthenticationMixin, AsyncThrottleMixin, View):
+    """
+    ASGI-native version of ReferralCodeByEmailView.
+    Requires user's JWT access token.
+    GET request: returns referral code of the user whose email was in the URL
+    (if the user has it).
+    """
+    throttle_classes = [UserTokenBucketThrottle, IPTokenBucketThrottle]
+    throttle_scope = 'email_lookup'
+
+    async def get(self, request, email):
+        try:
+            validate_email(email)
+        except ValidationError:
+            return JsonResponse({"error": "Invalid email address!"}, status=status.HTTP_400_BAD_REQUEST)
+
+        referral_code = await aget_code_by_email(email)
+        if not referral_code:
+            return JsonResponse({"error": "Referral code not found for the given email!"},
+                                status=status.HTTP_404_NOT_FOUND)
+        if referral_code.expiration_date < timezone.now():
+            return JsonResponse({"error": "This user's referral code has expired!"}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(ReferralCodeSerializer(referral_code).data, status=status.HTTP_200_OK)
+
+
+class AsyncUserReferralListView(AsyncJWTAuthenticationMixin, View):
+    """
+    ASGI-native version of UserReferralListView.
+    Requires user's JWT access token.
+    GET request: takes pk from the url and returns a page of referrals of corresponding user,
+    ordered by registration date. Pass the "next" link to get the following page.
+    """
+    pagination_class = ReferralCursorPagination
+
+    async def get(self, request, pk):
+        try:
+            referrer_exists = await User.objects.filter(pk=pk).aexists()
+        except ValidationError:
+            referrer_exists = False
+        if not referrer_exists:
+            return JsonResponse({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        paginator = self.pagination_class()
+        referrals = ReferralListSerializer.project(User.objects.filter(referrer_id=pk))
+        page = await paginator.apaginate_queryset(referrals, request)
+        serializer = ReferralListSerializer(page, many=True)
+        return JsonResponse(paginator.get_paginated_data(serializer.data), status=status.HTTP_200_OK)
@@ -0,0 +1,97 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+def active_cache_key(user_id):
+    return f"jwt_user_active:{user_id}"
+
+
+def is_user_active(user_model, user_id):
+    """
+    Returns whether the user exists and is active (None if the user does not
+    exist). The answer is cached for JWT_USER_ACTIVE_CACHE_TTL seconds, so
+    deactivating a user takes effect within that window.
+    """
+    key = active_cache_key(user_id)
+    is_active = cache.get(key)
+    if is_active is None:
+        is_active = user_model.objects.filter(pk=user_id).values_list('is_active', flat=True).first()
+        if is_active is not None:
+            cache.set(key, is_active, settings.JWT_USER_ACTIVE_CACHE_TTL)
+    return is_active
+
+
+async def ais_user_active(user_model, user_id):
+    key = active_cache_key(user_id)
+    is_active = await cache.aget(key)
+    if is_active is None:
+        is_active = await user_model.objects.filter(pk=user_id).values_list('is_active', flat=True).afirst()
+        if is_active is not None:
+            await cache.aset(key, is_active, settings.JWT_USER_ACTIVE_CACHE_TTL)
+    return is_active
+
+
+def check_active(is_active):
+    if is_active is None:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+    if not is_active:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Trusts the signed user id claim instead of loading the user on every request.
+    request.user is a User instance with every field but the primary key deferred:
+    views that only need request.user.id never query the user table, and a view
+    touching another field loads it on first access.
+    """
+    def get_user_id(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            return self.user_model._meta.pk.to_python(user_id)
+        except ValidationError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def make_user(self, user_id):
+        return self.user_model.from_db(None, [self.user_model._meta.pk.attname], [user_id])
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Revocation is checked against the password hash, which needs the full row.
+            return super().get_user(validated_token)
+
+        user_id = self.get_user_id(validated_token)
+        if settings.JWT_USER_ACTIVE_CACHE_TTL > 0:
+            check_active(is_user_active(self.user_model, user_id))
+        return self.make_user(user_id)
+
+    async def aauthenticate(self, request):
+        """
+        Async counterpart of authenticate() for plain Django async views.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return await sync_to_async(super().get_user)(validated_token), validated_token
+
+        user_id = self.get_user_id(validated_token)
+        if settings.JWT_USER_ACTIVE_CACHE_TTL > 0:
+            check_active(await ais_user_active(self.user_model, user_id))
+        return self.make_user(user_id), validated_token
@@ -0,0 +1,15 @@
+from django.db.backends.mysql.base import Database, DatabaseWrapper as MySQLDatabaseWrapper
+
+from my_referrals.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, MySQLDatabaseWrapper):
+    """
+    MySQL backend with a per-process connection pool (ENGINE 'my_referrals.backends.mysql').
+    """
+    def check_pooled_connection(self, connection):
+        try:
+            connection.ping()
+        except Database.Error:
+            return False
+        return True
@@ -0,0 +1,255 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from .models import ReferralCode
+from .routers import is_pinned, read_alias
+from .utils import normalize_code, normalize_email_address
+
+DEFAULTS = {
+    # Alias in CACHES of the backend shared by all workers
+    'ALIAS': 'default',
+    # Upper bound of how long a code stays in the shared tier, in seconds (0 disables caching)
+    'TTL': 300,
+    # How long a code stays in the in-process tier. Other workers only see
+    # invalidations through the shared tier, so keep this short.
+    'LOCAL_TTL': 5,
+    'LOCAL_MAX_SIZE': 10000,
+    # Seconds after an invalidation during which codes read from the database
+    # aren't cached, as they may have been read before it. Covers the time
+    # between a query and the cache write, plus clock skew between workers.
+    'INVALIDATION_GRACE': 2,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'REFERRAL_CODE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class LocalTTLCache:
+    """
+    Thread-safe in-process LRU cache whose entries expire after their own TTL.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LocalTTLCache(get_setting('LOCAL_MAX_SIZE'))
+
+
+def shared_cache():
+    return caches[get_setting('ALIAS')]
+
+
+def make_key(kind, value):
+    return f"referral_code:{kind}:{hashlib.sha1(str(value).encode()).hexdigest()}"
+
+
+def generation_key(user_id):
+    return f"referral_code:generation:{user_id}"
+
+
+def get_ttl(referral_code):
+    """
+    Seconds a code may stay cached: never past its expiration date, so an
+    expired code is always read back from the database.
+    """
+    ttl = get_setting('TTL')
+    if referral_code.expiration_date is not None:
+        ttl = min(ttl, int((referral_code.expiration_date - timezone.now()).total_seconds()))
+    return ttl
+
+
+def new_generation(invalidated_at=0.0):
+    return uuid.uuid4().hex, invalidated_at
+
+
+def get_generation(user_id):
+    """
+    Returns the current generation of the user's cached codes: a token, and
+    when the last invalidation set it. Cached codes are stored with the
+    generation they were filled under and only served while it is current,
+    so invalidate_user_codes() only has to replace it: every key holding the
+    user's code is then stale.
+    """
+    key = generation_key(user_id)
+    generation = local_cache.get(key)
+    if generation is None:
+        cache = shared_cache()
+        cache.add(key, new_generation(), get_setting('TTL'))
+        generation = cache.get(key)
+        local_cache.set(key, generation, get_setting('LOCAL_TTL'))
+    return generation
+
+
+async def aget_generation(user_id):
+    key = generation_key(user_id)
+    generation = local_cache.get(key)
+    if generation is None:
+        cache = shared_cache()
+        await cache.aadd(key, new_generation(), get_setting('TTL'))
+        generation = await cache.aget(key)
+        local_cache.set(key, generation, get_setting('LOCAL_TTL'))
+    return generation
+
+
+def cache_locally(key, entry):
+    local_ttl = min(get_ttl(entry[0]), get_setting('LOCAL_TTL'))
+    if local_ttl > 0:
+        local_cache.set(key, entry, local_ttl)
+
+
+def fill_entry(referral_code, generation):
+    """
+    Entry to cache a code just read from the database under, or None if the
+    code may have been read before an invalidation of the user's codes: the
+    code is only known after the query, so its generation can't be read
+    before it, and a generation set in the last INVALIDATION_GRACE seconds
+    may be newer than the code.
+    """
+    if get_ttl(referral_code) <= 0 or time.time() - generation[1] < get_setting('INVALIDATION_GRACE'):
+        return None
+    return referral_code, generation
+
+
+def read_through(key, load):
+    """
+    Returns the code cached under key, or loads it with load(), which makes a
+    single query, and caches it.
+    """
+    entry = local_cache.get(key)
+    if entry is None:
+        entry = shared_cache().get(key)
+        if entry is not None:
+            cache_locally(key, entry)
+    if entry is not None and entry[1] == get_generation(entry[0].user_id):
+        return entry[0]
+
+    referral_code = load()
+    if referral_code is None:
+        return None
+    entry = fill_entry(referral_code, get_generation(referral_code.user_id))
+    if entry is not None:
+        shared_cache().set(key, entry, get_ttl(referral_code))
+        cache_locally(key, entry)
+    return referral_code
+
+
+async def aread_through(key, aload):
+    """
+    Async counterpart of read_through(): talks to the shared tier with the
+    cache's async API and awaits aload() on a miss.
+    """
+    entry = local_cache.get(key)
+    if entry is None:
+        entry = await shared_cache().aget(key)
+        if entry is not None:
+            cache_locally(key, entry)
+    if entry is not None and entry[1] == await aget_generation(entry[0].user_id):
+        return entry[0]
+
+    referral_code = await aload()
+    if referral_code is None:
+        return None
+    entry = fill_entry(referral_code, await aget_generation(referral_code.user_id))
+    if entry is not None:
+        await shared_cache().aset(key, entry, get_ttl(referral_code))
+        cache_locally(key, entry)
+    return referral_code
+
+
+def get_code_by_code(code):
+    code = normalize_code(code)
+    if code is None:
+        return None
+    return read_through(make_key('code', code), ReferralCode.objects.filter(code=code).first)
+
+
+def codes_by_email(email):
+    """
+    Codes of the users with the email, the earliest user's first.
+    """
+    return ReferralCode.objects.filter(user__email_normalized=email).order_by('user__date_joined')
+
+
+def get_code_by_email(email):
+    email = normalize_email_address(email)
+    if email is None:
+        return None
+
+    def load():
+        referral_code = codes_by_email(email).first()
+        if referral_code is not None and read_alias() != DEFAULT_DB_ALIAS and is_pinned(referral_code.user_id):
+            # The owner has just changed the code and the replica may not have it yet.
+            referral_code = codes_by_email(email).using(DEFAULT_DB_ALIAS).first()
+        return referral_code
+    return read_through(make_key('email', email), load)
+
+
+async def aget_code_by_email(email):
+    email = normalize_email_address(email)
+    if email is None:
+        return None
+    return await aread_through(make_key('email', email), codes_by_email(email).afirst)
+
+
+def invalidate_user_codes(user_id, emails=()):
+    """
+    Drops the user's cached codes, and the lookups by the given (normalized)
+    emails, which the user has just taken or given up.
+    """
+    cache = shared_cache()
+    keys = [generation_key(user_id), *(make_key('email', email) for email in emails if email)]
+    cache.set(keys[0], new_generation(time.time()), get_setting('TTL'))
+    cache.delete_many(keys[1:])
+    local_cache.delete_many(keys)
+
+
+async def ainvalidate_user_codes(user_id, emails=()):
+    cache = shared_cache()
+    keys = [generation_key(user_id), *(make_key('email', email) for email in emails if email)]
+    await cache.aset(keys[0], new_generation(time.time()), get_setting('TTL'))
+    await cache.adelete_many(keys[1:])
+    local_cache.delete_many(keys)
+
+
+def clear():
+    local_cache.clear()
+    shared_cache().clear()
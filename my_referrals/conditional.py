@@ -0,0 +1,69 @@
+import hashlib
+import time
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import parse_etags
+
+
+def digest(*parts):
+    return hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def not_modified(request, etag):
+    """
+    Returns the 304 (or 412) response to the request's conditional headers, or
+    None if the full response has to be sent.
+    """
+    return get_conditional_response(request, etag=etag)
+
+
+def add_validators(response, etag):
+    response['ETag'] = etag
+    # Revalidate every time, rather than reuse the response for a heuristic time.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def code_etag(request, referral_code):
+    """
+    ETag of a referral code, which changes on every rotation. There is no
+    Last-Modified: the time of the last rotation isn't stored.
+    """
+    return '"%s"' % digest(referral_code.user_id, referral_code.code, referral_code.expiration_date,
+                           request.accepted_media_type)
+
+
+def page_expires_at(rows):
+    """
+    Timestamp at which the first referral code in a page of the referral
+    listing expires and drops out of it, or 0 if the page shows no code.
+    """
+    expiration_dates = [row['referral_code_expiration_date'] for row in rows if row['referral_code_expiration_date']]
+    return int(min(expiration_dates).timestamp()) if expiration_dates else 0
+
+
+def referrals_etag(request, referrer, expires_at):
+    """
+    ETag of a page of the referrer's listing. Writes to the listing bump the
+    referrer's referrals_version, but codes also expire without any write, so
+    the page's expiry is part of the ETag, in the clear for referrals_not_modified().
+    """
+    return '"%d-%s"' % (expires_at, digest(referrer.pk, referrer.referrals_version, expires_at,
+                                           request.accepted_media_type, request.META.get('QUERY_STRING', '')))
+
+
+def referrals_not_modified(request, referrer):
+    """
+    Returns a 304 response if an ETag the client sent for the page is still
+    current, without reading the page, or None.
+    """
+    for etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        expires_at, _, _ = etag.removeprefix('W/').strip('"').partition('-')
+        if not expires_at.isdigit() or (expires_at != '0' and int(expires_at) <= time.time()):
+            # Not one of ours, or a code on the page has expired since.
+            continue
+        current = referrals_etag(request, referrer, int(expires_at))
+        response = not_modified(request, current)
+        if response is not None:
+            return add_validators(response, current)
+    return None
@@ -6,3 +6,50 @@ TOKEN_EXPIRATION_IN_DAYS: int = 1
 # Expiration date of the referral code
 REFERRAL_CODE_EXPIRATION_IN_DAYS: int = 3
 
+# Number of random base32 characters in a referral code (a check character is appended)
+REFERRAL_CODE_LENGTH: int = 10
+
+# Maximum length of a stored referral code (fits the 32-character hex format)
+REFERRAL_CODE_MAX_LENGTH: int = 32
+
+# Default and maximum number of referrals returned per page of the referral list
+REFERRALS_PAGE_SIZE: int = 100
+REFERRALS_MAX_PAGE_SIZE: int = 1000
+
+# Number of rows fetched per query when the referral list is streamed as NDJSON
+REFERRALS_STREAM_CHUNK_SIZE: int = 2000
+
+# Default and maximum depth of the referral tree returned by the tree endpoint
+REFERRAL_TREE_DEFAULT_DEPTH: int = 3
+REFERRAL_TREE_MAX_DEPTH: int = 10
+
+# Maximum number of descendants listed in one referral tree response
+REFERRAL_TREE_MAX_NODES: int = 1000
+
+# Default and maximum number of users on the referral leaderboard
+LEADERBOARD_DEFAULT_SIZE: int = 10
+LEADERBOARD_MAX_SIZE: int = 100
+
+# How many fresh codes are tried when a generated referral code collides with an existing one
+REFERRAL_CODE_GENERATION_ATTEMPTS: int = 5
+
+# Maximum number of users registered by one request to the batch registration endpoint
+REGISTRATION_BATCH_MAX_SIZE: int = 100
+
+# Number of users inserted per query by bulk registration and the import_users command
+REGISTRATION_INSERT_BATCH_SIZE: int = 1000
+
+# Number of expired referral codes deleted per query by purge_expired_codes
+EXPIRED_CODES_PURGE_BATCH_SIZE: int = 1000
+
+# Pause between two purge batches, in seconds
+EXPIRED_CODES_PURGE_PAUSE_IN_SECONDS: float = 0.1
+
+# Maximum number of throttled clients remembered in-process by each worker
+THROTTLE_LOCAL_MAX_SIZE: int = 10000
+
+# Maximum number of emails or codes resolved by one batch lookup request
+REFERRAL_CODE_BATCH_LOOKUP_MAX_SIZE: int = 100
+
+# Number of outbox events delivered per batch by drain_referral_events
+REFERRAL_EVENTS_DRAIN_BATCH_SIZE: int = 500
@@ -0,0 +1,109 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+    check_password,
+    make_password,
+)
+
+
+def get_setting(name):
+    return settings.PASSWORD_HASHING[name]
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the iteration count taken from PASSWORD_HASHING.
+    """
+    @property
+    def iterations(self):
+        return get_setting('PBKDF2_ITERATIONS')
+
+
+class TunableScryptPasswordHasher(ScryptPasswordHasher):
+    """
+    Scrypt with the work factor taken from PASSWORD_HASHING.
+    """
+    @property
+    def work_factor(self):
+        return get_setting('SCRYPT_WORK_FACTOR')
+
+    @property
+    def maxmem(self):
+        # OpenSSL refuses more than 32 MB by default; scrypt needs 128 * n * r bytes.
+        return 256 * self.work_factor * self.block_size
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2id with time cost, memory cost and parallelism taken from PASSWORD_HASHING.
+    Requires the argon2-cffi package.
+    """
+    @property
+    def time_cost(self):
+        return get_setting('ARGON2_TIME_COST')
+
+    @property
+    def memory_cost(self):
+        return get_setting('ARGON2_MEMORY_COST')
+
+    @property
+    def parallelism(self):
+        return get_setting('ARGON2_PARALLELISM')
+
+
+def verify_and_rehash(password, encoded):
+    """
+    Returns whether password matches encoded, and a new hash when the stored one
+    was made with another hasher or other cost settings (None otherwise).
+    Pure CPU work, so it can run in a worker thread or process.
+    """
+    rehashed = []
+    is_correct = check_password(password, encoded, setter=lambda raw: rehashed.append(make_password(raw)))
+    return is_correct, rehashed[0] if rehashed else None
+
+
+_executor = None
+
+
+def get_executor():
+    """
+    Returns the bounded pool password hashing is offloaded to, according to
+    PASSWORD_HASHING['OFFLOAD'] ("thread" or "process"), or None when hashing
+    runs inline.
+    """
+    global _executor
+    offload = get_setting('OFFLOAD')
+    if not offload:
+        return None
+    if _executor is None:
+        if offload == 'process':
+            _executor = ProcessPoolExecutor(max_workers=get_setting('POOL_SIZE'), initializer=django.setup)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=get_setting('POOL_SIZE'), thread_name_prefix='password-hashing')
+    return _executor
+
+
+async def run_hashing(func, *args):
+    """
+    Runs a hashing function without blocking the event loop: on the hashing
+    pool when offloading is enabled, otherwise on the default executor.
+    """
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+
+
+async def acheck_password(user, password):
+    """
+    Async counterpart of user.check_password(): the hash is verified off the
+    event loop, and an outdated hash is upgraded to the preferred hasher.
+    """
+    is_correct, rehashed = await run_hashing(verify_and_rehash, password, user.password)
+    if rehashed:
+        user.password = rehashed
+        await user.asave(update_fields=['password'])
+    return is_correct
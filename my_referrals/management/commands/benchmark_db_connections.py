@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+
+from my_referrals.models import User
+
+
+class Command(BaseCommand):
+    help = ("Measures the database cost of a request when every request opens its own connection, "
+            "with persistent connections (CONN_MAX_AGE, health-checked) and, with the pooled backend, "
+            "with pooled connections. Each simulated request runs one indexed lookup between the "
+            "request_started and request_finished signals, as the request handler does.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Number of requests per mode.")
+        parser.add_argument('--database', default='default', help="Database alias to benchmark.")
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        settings_dict = connection.settings_dict
+        original = settings_dict['CONN_MAX_AGE'], settings_dict['CONN_HEALTH_CHECKS']
+        pool = getattr(connection, 'pool', None)
+
+        modes = [('new connection', 0, False, 0), ('persistent', 600, True, 0)]
+        if pool is not None:
+            modes.append(('pooled', 0, False, pool.size))
+
+        pool_size = pool.size if pool is not None else 0
+        self.stdout.write(f"{'mode':<16}{'ms/request':>12}{'p99 ms':>10}{'connects':>10}")
+        try:
+            for name, max_age, health_checks, size in modes:
+                connection.close()
+                if pool is not None:
+                    pool.size = size
+                    pool.clear()
+                settings_dict['CONN_MAX_AGE'], settings_dict['CONN_HEALTH_CHECKS'] = max_age, health_checks
+
+                timings = []
+                # Kept referenced, so ids of closed connections are not reused.
+                used = []
+                for _ in range(options['requests']):
+                    request_started.send(sender=self.__class__)
+                    start = time.perf_counter()
+                    User.objects.using(options['database']).filter(username='').exists()
+                    timings.append(time.perf_counter() - start)
+                    used.append(connection.connection)
+                    request_finished.send(sender=self.__class__)
+
+                timings.sort()
+                connects = len({id(raw) for raw in used})
+                self.stdout.write(f"{name:<16}{sum(timings) / len(timings) * 1000:>12.3f}"
+                                  f"{timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000:>10.3f}{connects:>10}")
+        finally:
+            connection.close()
+            settings_dict['CONN_MAX_AGE'], settings_dict['CONN_HEALTH_CHECKS'] = original
+            if pool is not None:
+                pool.size = pool_size
@@ -0,0 +1,59 @@
+import io
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from my_referrals import renderers
+from my_referrals.parsers import FastJSONParser
+from my_referrals.renderers import FastJSONRenderer
+from my_referrals.serializers import ReferralListSerializer
+
+
+class Command(BaseCommand):
+    help = ("Measures how many referrals per second DRF's JSONRenderer and JSONParser encode and decode, "
+            "versus FastJSONRenderer and FastJSONParser, on a referral list page and on a batch payload "
+            "of UUIDs and timezone-aware datetimes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--referrals', type=int, default=10000, help="Number of referrals per payload.")
+        parser.add_argument('--repeat', type=int, default=20, help="Times each payload is encoded and decoded.")
+
+    def payloads(self, size):
+        now = timezone.now()
+        serializer = ReferralListSerializer()
+        rows = [
+            {'username': f'referral_{i}', 'date_joined': now, 'id': uuid.uuid4(),
+             'referral_code': f'CODE{i:08d}', 'referral_code_expiration_date': now}
+            for i in range(size)
+        ]
+        return {
+            'referral list': {'next': None, 'results': [serializer.to_representation(row) for row in rows]},
+            'batch': {'results': [{'id': row['id'], 'registered_at': row['date_joined']} for row in rows]},
+        }
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stdout.write("orjson isn't installed: the fast classes fall back to DRF's.")
+        size, repeat = options['referrals'], options['repeat']
+        self.stdout.write(f"{'payload':<16}{'classes':<10}{'render rows/s':>15}{'parse rows/s':>15}")
+        for name, data in self.payloads(size).items():
+            for classes, renderer, parser in (
+                ('DRF', JSONRenderer(), JSONParser()),
+                ('fast', FastJSONRenderer(), FastJSONParser()),
+            ):
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    content = renderer.render(data, 'application/json')
+                render_elapsed = time.perf_counter() - start
+
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    parser.parse(io.BytesIO(content), 'application/json', {'encoding': 'utf-8'})
+                parse_elapsed = time.perf_counter() - start
+
+                self.stdout.write(f"{name:<16}{classes:<10}{size * repeat / render_elapsed:>15.0f}"
+                                  f"{size * repeat / parse_elapsed:>15.0f}")
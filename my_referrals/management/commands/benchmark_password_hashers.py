@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+
+class Command(BaseCommand):
+    help = ("Measures how many password verifications (i.e. logins) per second a single core "
+            "sustains with each hashing tier of PASSWORD_HASHING_TIERS, using the current cost settings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                            help="Number of verifications timed per tier.")
+        parser.add_argument('--tiers', nargs='+', choices=list(settings.PASSWORD_HASHING_TIERS),
+                            default=list(settings.PASSWORD_HASHING_TIERS),
+                            help="Tiers to benchmark.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'tier':<10}{'ms/login':>12}{'logins/s/core':>16}")
+        for tier in options['tiers']:
+            hasher = import_string(settings.PASSWORD_HASHING_TIERS[tier])()
+            try:
+                encoded = hasher.encode('benchmark-password', hasher.salt())
+            except (ImportError, ValueError) as e:
+                self.stdout.write(f"{tier:<10}  skipped: {e}")
+                continue
+
+            start = time.perf_counter()
+            for _ in range(options['iterations']):
+                hasher.verify('benchmark-password', encoded)
+            elapsed = (time.perf_counter() - start) / options['iterations']
+            self.stdout.write(f"{tier:<10}{elapsed * 1000:>12.1f}{1 / elapsed:>16.1f}")
@@ -0,0 +1,47 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from my_referrals.constants import REFERRALS_STREAM_CHUNK_SIZE
+from my_referrals.models import User
+from my_referrals.pagination import iterate_in_chunks
+from my_referrals.serializers import ReferralListSerializer, UserSerializer
+
+
+class Command(BaseCommand):
+    help = ("Measures how many referrals per second the referral listing reads and serializes, "
+            "with full User rows and UserSerializer versus the values() projection and "
+            "ReferralListSerializer. The referrals are created in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--referrals', type=int, default=100000, help="Number of referrals listed.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            referrer = User.objects.create(username='benchmark_referrer')
+            password = make_password(None)
+            User.objects.bulk_create(
+                (User(username=f'benchmark_referral_{i}', password=password, referrer=referrer)
+                 for i in range(options['referrals'])),
+                batch_size=5000,
+            )
+            referrals = User.objects.filter(referrer=referrer)
+
+            full_serializer = UserSerializer()
+            slim_serializer = ReferralListSerializer()
+            self.stdout.write(f"{'path':<16}{'rows/s':>12}{'seconds':>10}")
+            for name, queryset, serializer in (
+                ('model rows', referrals, full_serializer),
+                ('values()', ReferralListSerializer.project(referrals), slim_serializer),
+            ):
+                count = 0
+                start = time.perf_counter()
+                for row in iterate_in_chunks(queryset, REFERRALS_STREAM_CHUNK_SIZE):
+                    serializer.to_representation(row)
+                    count += 1
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{name:<16}{count / elapsed:>12.0f}{elapsed:>10.2f}")
+
+            transaction.set_rollback(True)
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter per settings module: times setup of Django, the
+# WSGI handler (middleware chain) and the URLconf, then requests answered by
+# the middleware and DRF alone (a GET on a POST-only endpoint), so the
+# difference between settings modules is their per-request overhead.
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+cold_start = time.perf_counter() - start
+
+from django.test import Client
+client = Client()
+requests = int(sys.argv[1])
+start = time.perf_counter()
+for _ in range(requests):
+    client.get('/api/token/verify/')
+per_request = (time.perf_counter() - start) / requests
+print(json.dumps({'cold_start': cold_start, 'per_request': per_request, 'modules': len(sys.modules)}))
+"""
+
+
+class Command(BaseCommand):
+    help = ("Compares settings modules by worker cold-start time (Django setup, middleware and URLconf "
+            "loading, in a fresh interpreter) and per-request middleware overhead.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-modules', nargs='+',
+                            default=['referral_service.settings', 'referral_service.settings_production'],
+                            help="Settings modules to compare.")
+        parser.add_argument('--requests', type=int, default=1000, help="Requests timed per settings module.")
+        parser.add_argument('--runs', type=int, default=3,
+                            help="Cold starts per settings module; the fastest one is reported.")
+
+    def measure(self, settings_module, requests):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module}
+        result = subprocess.run([sys.executable, '-c', CHILD, str(requests)], env=env,
+                                capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f"{settings_module} failed to start:\n{result.stderr}")
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'settings':<40}{'cold start ms':>15}{'modules':>10}{'us/request':>12}")
+        for settings_module in options['settings_modules']:
+            runs = [self.measure(settings_module, options['requests']) for _ in range(options['runs'])]
+            self.stdout.write(
+                f"{settings_module:<40}{min(run['cold_start'] for run in runs) * 1000:>15.1f}"
+                f"{runs[0]['modules']:>10}{min(run['per_request'] for run in runs) * 1e6:>12.1f}"
+            )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from my_referrals.constants import REFERRAL_EVENTS_DRAIN_BATCH_SIZE
+from my_referrals.outbox import drain, get_sinks
+
+
+class Command(BaseCommand):
+    help = ("Delivers the referral events waiting in the outbox to the sinks of REFERRAL_EVENT_SINKS "
+            "in batches, deleting each batch once every sink has accepted it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REFERRAL_EVENTS_DRAIN_BATCH_SIZE,
+                            help="Maximum number of events delivered per batch.")
+        parser.add_argument('--every', type=float, default=0,
+                            help="Keep running and drain the outbox again every N seconds (default: drain once).")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+        sinks = get_sinks()
+        if not sinks:
+            raise CommandError("No sinks configured in REFERRAL_EVENT_SINKS.")
+
+        while True:
+            delivered = 0
+            while batch := drain(sinks, options['batch_size']):
+                delivered += batch
+            self.stdout.write(f"Delivered {delivered} referral events.")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
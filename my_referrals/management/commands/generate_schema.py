@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+from referral_service.schema import api_info
+
+
+class Command(BaseCommand):
+    help = ("Writes the OpenAPI schema of the API to a JSON file, to be served as a static file "
+            "(API_SCHEMA_FILE) instead of being generated by drf-yasg at runtime. Run at build time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default=settings.API_SCHEMA_FILE,
+                            help="File to write (default: API_SCHEMA_FILE).")
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError("Give the output file or set API_SCHEMA_FILE.")
+        schema = OpenAPISchemaGenerator(api_info).get_schema(request=None, public=True)
+        with open(options['output'], 'wb') as file:
+            file.write(OpenAPICodecJson(validators=[], pretty=True).encode(schema))
+        self.stdout.write(f"Wrote the API schema to {options['output']}.")
@@ -0,0 +1,89 @@
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from my_referrals.constants import REGISTRATION_INSERT_BATCH_SIZE
+from my_referrals.registration import register_users
+
+
+def read_jsonl(file):
+    """
+    Yields (line number, row, error) for every non-empty line.
+    """
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(row, dict):
+            yield line_number, row, None
+        else:
+            yield line_number, None, "Row must be a JSON object"
+
+
+def read_csv(file):
+    reader = csv.DictReader(file)
+    for row in reader:
+        yield reader.line_num, {field: value for field, value in row.items() if value}, None
+
+
+class Command(BaseCommand):
+    help = ("Registers users from a JSONL or CSV file (fields: username, password, email, referral_code), "
+            "reading it in batches. Rows that fail validation are reported and skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for standard input.")
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help="Input format (guessed from the file extension by default).")
+        parser.add_argument('--batch-size', type=int, default=REGISTRATION_INSERT_BATCH_SIZE,
+                            help="Number of users resolved and inserted at once.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of processes hashing passwords (1 hashes in this process).")
+
+    def handle(self, *args, **options):
+        input_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        executor = None
+        if options['workers'] > 1:
+            executor = ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup)
+
+        try:
+            if options['path'] == '-':
+                created, failed = self.import_file(sys.stdin, input_format, options['batch_size'], executor)
+            else:
+                with open(options['path'], newline='', encoding='utf-8') as file:
+                    created, failed = self.import_file(file, input_format, options['batch_size'], executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {created} users, {failed} rows failed."))
+
+    def import_file(self, file, input_format, batch_size, executor):
+        rows = read_csv(file) if input_format == 'csv' else read_jsonl(file)
+        created = failed = 0
+        while batch := list(islice(rows, batch_size)):
+            parsed = [(line_number, row) for line_number, row, error in batch if error is None]
+            for line_number, row, error in batch:
+                if error is not None:
+                    self.stderr.write(f"line {line_number}: {error}")
+                    failed += 1
+
+            results = register_users([row for _, row in parsed], batch_size=batch_size, executor=executor)
+            for (line_number, _), result in zip(parsed, results):
+                if 'error' in result:
+                    self.stderr.write(f"line {line_number}: {result['username']}: {result['error']}")
+                    failed += 1
+                else:
+                    created += 1
+        return created, failed
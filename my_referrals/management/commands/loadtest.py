@@ -0,0 +1,240 @@
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections, transaction
+from django.test import Client
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from my_referrals.metrics import QueryTracker
+from my_referrals.models import ReferralCode, User
+from my_referrals.tree import link_referrals
+from my_referrals.utils import generate_code, get_code_expiration_time
+
+# Prefix of every user created by the seed action
+USERNAME_PREFIX = 'loadtest_'
+
+# Password of every seeded user
+SEED_PASSWORD = 'loadtest-password'
+
+SEED_BATCH_SIZE = 1000
+
+DEFAULT_MIX = 'register=1,login=1,ref_code=4,ref_code_by_email=4,referrals_list=2'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in TRACE_BUILDERS:
+            raise CommandError(f"Unknown request type in mix: {name!r}.")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def seed_user(index, password, referrer=None):
+    # Built for bulk_create(), which skips User.save(), so email_normalized is set here.
+    email = f"{USERNAME_PREFIX}{index}@example.com"
+    return User(username=f"{USERNAME_PREFIX}{index}", email=email, email_normalized=email, password=password,
+                referrer=referrer)
+
+
+def build_register(seeded):
+    referrer = random.choice(seeded['referrers'])
+    return 'POST', reverse('register'), None, {
+        'username': f"{USERNAME_PREFIX}new_{uuid.uuid4().hex[:12]}",
+        'password': SEED_PASSWORD,
+        'referral_code': referrer['code'],
+    }
+
+
+def build_login(seeded):
+    user = random.choice(seeded['users'])
+    return 'POST', reverse('login'), None, {'username': user['username'], 'password': SEED_PASSWORD}
+
+
+def build_ref_code(seeded):
+    referrer = random.choice(seeded['referrers'])
+    return 'GET', reverse('referral_code_use'), referrer['username'], None
+
+
+def build_ref_code_by_email(seeded):
+    user = random.choice(seeded['users'])
+    referrer = random.choice(seeded['referrers'])
+    return 'GET', reverse('referral_code_get_by_email', kwargs={'email': referrer['email']}), user['username'], None
+
+
+def build_referrals_list(seeded):
+    user = random.choice(seeded['users'])
+    referrer = random.choice(seeded['referrers'])
+    return 'GET', reverse('check_referrals_by_id', kwargs={'pk': referrer['id']}), user['username'], None
+
+
+TRACE_BUILDERS = {
+    'register': build_register,
+    'login': build_login,
+    'ref_code': build_ref_code,
+    'ref_code_by_email': build_ref_code_by_email,
+    'referrals_list': build_referrals_list,
+}
+
+
+class Command(BaseCommand):
+    help = ("Load-testing harness. 'seed' creates users, referrers and referral codes; 'record' writes a JSONL "
+            "trace of a traffic mix over the seeded data (one request per line: request_id, name, method, path, "
+            "user, remote_addr, body); 'replay' runs a trace concurrently in-process against the configured "
+            "database and reports throughput, p50/p99 latency and queries per request for each request type.")
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest='action', required=True)
+
+        seed = actions.add_parser('seed', help="Create load-testing users.")
+        seed.add_argument('--users', type=int, default=1000, help="Number of referred users.")
+        seed.add_argument('--referrers', type=int, default=100, help="Number of referrers with a referral code.")
+
+        record = actions.add_parser('record', help="Write a trace of requests over the seeded data.")
+        record.add_argument('output', help="JSONL file to write.")
+        record.add_argument('--requests', type=int, default=1000, help="Number of requests in the trace.")
+        record.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help=f"Weights of each request type (default: {DEFAULT_MIX}).")
+        record.add_argument('--seed', type=int, help="Random seed, for reproducible traces.")
+
+        replay = actions.add_parser('replay', help="Replay a trace and report latency and query counts.")
+        replay.add_argument('trace', help="JSONL trace written by 'record'.")
+        replay.add_argument('--concurrency', type=int, default=8, help="Number of concurrent clients.")
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])(options)
+
+    def seed(self, options):
+        password = make_password(SEED_PASSWORD)
+        start = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+
+        referrers = [seed_user(start + i, password) for i in range(options['referrers'])]
+        with transaction.atomic():
+            User.objects.bulk_create(referrers, batch_size=SEED_BATCH_SIZE)
+            ReferralCode.objects.bulk_create([
+                ReferralCode(user=referrer, code=generate_code(), expiration_date=get_code_expiration_time())
+                for referrer in referrers
+            ], batch_size=SEED_BATCH_SIZE)
+
+        start += len(referrers)
+        for offset in range(0, options['users'], SEED_BATCH_SIZE):
+            users = [
+                seed_user(start + i, password, random.choice(referrers) if referrers else None)
+                for i in range(offset, min(offset + SEED_BATCH_SIZE, options['users']))
+            ]
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                link_referrals(users)
+
+        self.stdout.write(f"Seeded {len(referrers)} referrers and {options['users']} referred users.")
+
+    def load_seeded(self):
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX)
+                     .exclude(username__startswith=f"{USERNAME_PREFIX}new_")
+                     .values('id', 'username', 'email', 'referralcode__code'))
+        referrers = [
+            {**user, 'id': str(user['id']), 'code': user['referralcode__code']}
+            for user in users if user['referralcode__code']
+        ]
+        if not referrers:
+            raise CommandError("No seeded referrers found, run 'loadtest seed' first.")
+        return {'users': users, 'referrers': referrers}
+
+    def record(self, options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        seeded = self.load_seeded()
+        names = list(options['mix'])
+        weights = list(options['mix'].values())
+
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            for index in range(options['requests']):
+                name = random.choices(names, weights)[0]
+                method, path, user, body = TRACE_BUILDERS[name](seeded)
+                file.write(json.dumps({
+                    'request_id': f"req-{index:06d}",
+                    'name': name,
+                    'method': method,
+                    'path': path,
+                    'user': user,
+                    'remote_addr': f"10.{random.randrange(256)}.{random.randrange(256)}.{random.randrange(1, 255)}",
+                    'body': body,
+                }) + '\n')
+        self.stdout.write(f"Recorded {options['requests']} requests to {options['output']}.")
+
+    def replay(self, options):
+        with open(options['trace'], encoding='utf-8') as file:
+            trace = [json.loads(line) for line in file if line.strip()]
+
+        usernames = {entry['user'] for entry in trace if entry.get('user')}
+        tokens = {
+            user.username: f"Bearer {AccessToken.for_user(user)}"
+            for user in User.objects.filter(username__in=usernames)
+        }
+
+        def run(entries):
+            client = Client()
+            results = []
+            try:
+                for entry in entries:
+                    headers = {'REMOTE_ADDR': entry.get('remote_addr') or '127.0.0.1'}
+                    if entry.get('user'):
+                        headers['HTTP_AUTHORIZATION'] = tokens.get(entry['user'], '')
+                    tracker = QueryTracker()
+                    start = time.perf_counter()
+                    with ExitStack() as stack:
+                        for connection in connections.all():
+                            stack.enter_context(connection.execute_wrapper(tracker))
+                        response = client.generic(entry['method'], entry['path'],
+                                                  json.dumps(entry['body']) if entry.get('body') else '',
+                                                  content_type='application/json', **headers)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                    results.append((entry['name'], time.perf_counter() - start, tracker.count, response.status_code))
+            finally:
+                close_old_connections()
+            return results
+
+        concurrency = max(options['concurrency'], 1)
+        shards = [trace[i::concurrency] for i in range(concurrency)]
+        start = time.perf_counter()
+        if concurrency == 1:
+            results = run(trace)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = [result for shard_results in executor.map(run, shards) for result in shard_results]
+        elapsed = time.perf_counter() - start
+
+        self.report(results, elapsed)
+
+    def report(self, results, elapsed):
+        by_name = defaultdict(list)
+        for result in results:
+            by_name[result[0]].append(result)
+        by_name['total'] = results
+
+        self.stdout.write(f"{'request':<20}{'count':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+                          f"{'queries':>10}{'errors':>8}")
+        for name, rows in by_name.items():
+            latencies = sorted(row[1] for row in rows)
+            queries = sum(row[2] for row in rows) / len(rows)
+            errors = sum(row[3] >= 400 for row in rows)
+            self.stdout.write(
+                f"{name:<20}{len(rows):>8}{len(rows) / elapsed:>10.1f}{percentile(latencies, 0.5) * 1000:>10.1f}"
+                f"{percentile(latencies, 0.99) * 1000:>10.1f}{queries:>10.1f}{errors:>8}"
+            )
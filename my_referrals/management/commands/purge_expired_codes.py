@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from my_referrals.constants import EXPIRED_CODES_PURGE_BATCH_SIZE, EXPIRED_CODES_PURGE_PAUSE_IN_SECONDS
+from my_referrals.models import ReferralCode
+
+
+class Command(BaseCommand):
+    help = ("Deletes expired referral codes in small primary-key-ranged batches, pausing between "
+            "batches so the cleanup never holds long locks or floods replication.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EXPIRED_CODES_PURGE_BATCH_SIZE,
+                            help="Maximum number of codes deleted per query.")
+        parser.add_argument('--sleep', type=float, default=EXPIRED_CODES_PURGE_PAUSE_IN_SECONDS,
+                            help="Seconds to pause between batches.")
+        parser.add_argument('--every', type=float, default=0,
+                            help="Keep running and purge again every N seconds (default: purge once).")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        while True:
+            deleted = sum(ReferralCode.objects.purge_expired(options['batch_size'], options['sleep']))
+            self.stdout.write(f"Deleted {deleted} expired referral codes.")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
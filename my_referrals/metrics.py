@@ -0,0 +1,238 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.permissions import BasePermission, IsAdminUser
+from rest_framework.views import APIView
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the per-request query count histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """
+    Per-process request metrics. Each worker process keeps its own registry,
+    so Prometheus should scrape every worker (or sum over them).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = {}
+        self.latency = {}
+        self.query_counts = {}
+        self.db_time = {}
+
+    def observe(self, route, method, status_code, duration, query_count, db_time):
+        with self._lock:
+            key = (route, method)
+            self.requests[(route, method, status_code)] = self.requests.get((route, method, status_code), 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.query_counts.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(query_count)
+            self.db_time[key] = self.db_time.get(key, 0.0) + db_time
+
+    def render(self):
+        with self._lock:
+            lines = [
+                '# HELP http_requests_total Requests served, by route, method and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (route, method, status_code), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{route="{escape_label(route)}",method="{escape_label(method)}",'
+                             f'status="{status_code}"}} {count}')
+
+            lines += [
+                '# HELP http_request_duration_seconds Time spent producing the response.',
+                '# TYPE http_request_duration_seconds histogram',
+            ]
+            for (route, method), histogram in sorted(self.latency.items()):
+                lines += histogram.render('http_request_duration_seconds',
+                                          f'route="{escape_label(route)}",method="{escape_label(method)}"')
+
+            lines += [
+                '# HELP http_request_db_queries SQL queries executed per request.',
+                '# TYPE http_request_db_queries histogram',
+            ]
+            for (route, method), histogram in sorted(self.query_counts.items()):
+                lines += histogram.render('http_request_db_queries',
+                                          f'route="{escape_label(route)}",method="{escape_label(method)}"')
+
+            lines += [
+                '# HELP http_request_db_seconds_total Time spent in SQL queries.',
+                '# TYPE http_request_db_seconds_total counter',
+            ]
+            for (route, method), seconds in sorted(self.db_time.items()):
+                lines.append(f'http_request_db_seconds_total{{route="{escape_label(route)}",method="{escape_label(method)}"}} '
+                             f'{seconds}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class QueryTracker:
+    """
+    Database execute wrapper counting the queries of a request and the time
+    spent in them.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+@contextmanager
+def track_queries(tracker):
+    """
+    Installs the tracker on the connections of the current thread.
+    """
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(tracker))
+        yield
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, query count and database time of every request, labelled
+    by URL route. Removes itself from the middleware chain unless
+    METRICS_ENABLED is set, so it costs nothing when disabled. With
+    METRICS_SERVER_TIMING the same numbers are sent in a Server-Timing header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tracker = QueryTracker()
+        start = time.perf_counter()
+        with track_queries(tracker):
+            response = self.get_response(request)
+        return self.record(request, response, time.perf_counter() - start, tracker)
+
+    async def __acall__(self, request):
+        """
+        Async counterpart of __call__(), so async views aren't moved to a thread
+        for the middleware. The async ORM runs queries in the request's
+        thread-sensitive thread, so the tracker is installed there.
+        """
+        tracker = QueryTracker()
+        stack = ExitStack()
+        await sync_to_async(stack.enter_context)(track_queries(tracker))
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            await sync_to_async(stack.close)()
+        return self.record(request, response, duration, tracker)
+
+    def record(self, request, response, duration, tracker):
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        registry.observe(route, request.method, response.status_code, duration, tracker.count, tracker.duration)
+
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'app;dur={duration * 1000:.1f}, '
+                f'db;dur={tracker.duration * 1000:.1f};desc="{tracker.count} queries"'
+            )
+        return response
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates scrapers sending METRICS_TOKEN as a bearer token, leaving
+    other tokens to the authentication classes that follow.
+    """
+    def authenticate(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+            return AnonymousUser(), token
+        return None
+
+    def authenticate_header(self, request):
+        # Unauthenticated requests get a 401 rather than a 403.
+        return 'Bearer realm="api"'
+
+
+class IsMetricsScraper(BasePermission):
+    def has_permission(self, request, view):
+        return isinstance(request.successful_authenticator, MetricsTokenAuthentication)
+
+
+class MetricsView(APIView):
+    """
+    Requires JWT access token of a staff user, or METRICS_TOKEN as a bearer token.
+    Exposes the metrics of this worker in the Prometheus text format.
+    """
+    authentication_classes = [MetricsTokenAuthentication, *APIView.authentication_classes]
+    permission_classes = [IsMetricsScraper | IsAdminUser]
+    throttle_classes = []
+    # Not part of the API (keeps it out of the generated schema).
+    swagger_schema = None
+
+    def initial(self, request, *args, **kwargs):
+        if not settings.METRICS_ENABLED:
+            raise Http404
+        super().initial(request, *args, **kwargs)
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+metrics_view = MetricsView.as_view()
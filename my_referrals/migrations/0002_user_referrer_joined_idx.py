@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('my_referrals', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['referrer', 'date_joined', 'id'], name='user_referrer_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def build_referral_tree(apps, schema_editor):
+    """
+    Builds the closure table one depth at a time: (A, U, d) exists exactly when
+    (A, U.referrer, d - 1) does.
+    """
+    User = apps.get_model('my_referrals', 'User')
+    ReferralTreePath = apps.get_model('my_referrals', 'ReferralTreePath')
+
+    referred = User.objects.filter(referrer__isnull=False).order_by('pk').values_list('pk', 'referrer_id')
+    batch = []
+    for pk, referrer_id in referred.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ReferralTreePath(ancestor_id=referrer_id, descendant_id=pk, depth=1))
+        if len(batch) >= BATCH_SIZE:
+            ReferralTreePath.objects.bulk_create(batch)
+            batch = []
+    ReferralTreePath.objects.bulk_create(batch)
+
+    depth = 1
+    while True:
+        created = 0
+        last_pk = 0
+        while True:
+            paths = list(
+                ReferralTreePath.objects.filter(depth=depth, pk__gt=last_pk)
+                .order_by('pk').values_list('pk', 'ancestor_id', 'descendant_id')[:BATCH_SIZE]
+            )
+            if not paths:
+                break
+            last_pk = paths[-1][0]
+            ancestors_of = {}
+            for _, ancestor_id, descendant_id in paths:
+                ancestors_of.setdefault(descendant_id, []).append(ancestor_id)
+            children = User.objects.filter(referrer_id__in=ancestors_of).values_list('pk', 'referrer_id')
+            batch = [
+                ReferralTreePath(ancestor_id=ancestor_id, descendant_id=pk, depth=depth + 1)
+                for pk, referrer_id in children
+                for ancestor_id in ancestors_of[referrer_id]
+            ]
+            ReferralTreePath.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            created += len(batch)
+        if not created:
+            break
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_referrals', '0002_user_referrer_joined_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralTreePath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_paths', to=settings.AUTH_USER_MODEL)),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_paths', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='referral_path_subtree_idx'), models.Index(fields=['descendant', 'depth'], name='referral_path_ancestors_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='referraltreepath',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='referral_path_unique'),
+        ),
+        migrations.RunPython(build_referral_tree, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:59
+
+from django.db import migrations, models
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def count_referrals(apps, schema_editor):
+    User = apps.get_model('my_referrals', 'User')
+    ReferralTreePath = apps.get_model('my_referrals', 'ReferralTreePath')
+
+    for field, rows in (
+        ('direct_referrals_count', ReferralTreePath.objects.filter(depth=1)),
+        ('total_referrals_count', ReferralTreePath.objects.all()),
+    ):
+        counts = rows.values('ancestor_id').annotate(count=Count('pk')).order_by().values_list('ancestor_id', 'count')
+        batch = []
+        for pk, count in counts.iterator(chunk_size=BATCH_SIZE):
+            batch.append(User(pk=pk, **{field: count}))
+            if len(batch) >= BATCH_SIZE:
+                User.objects.bulk_update(batch, [field])
+                batch = []
+        User.objects.bulk_update(batch, [field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('my_referrals', '0003_referraltreepath'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='direct_referrals_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='total_referrals_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_referrals, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-direct_referrals_count', 'id'], name='user_direct_referrals_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-total_referrals_count', 'id'], name='user_total_referrals_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_referrals', '0004_user_referral_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='referralcode',
+            name='expiration_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_referrals', '0005_referralcode_expiration_date_index'),
+    ]
+
+    operations = [
+        # Every code generated so far is a 32-character hex code, so existing
+        # codes fit as they are and stay valid until they expire.
+        migrations.AlterField(
+            model_name='referralcode',
+            name='code',
+            field=models.CharField(max_length=32, unique=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:19
+
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Lower, NullIf, Trim
+
+BATCH_SIZE = 1000
+
+
+def normalize_emails(apps, schema_editor):
+    """
+    Fills email_normalized the way normalize_email_address() does, one
+    primary key range per UPDATE, so no statement locks the whole table.
+    """
+    User = apps.get_model('my_referrals', 'User')
+    users = User.objects.order_by('pk')
+    while pks := list(users.values_list('pk', flat=True)[:BATCH_SIZE]):
+        User.objects.filter(pk__in=pks).update(email_normalized=NullIf(Lower(Trim('email')), Value('')))
+        users = User.objects.filter(pk__gt=pks[-1]).order_by('pk')
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own instead of the backfill holding one long transaction.
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('my_referrals', '0006_compact_referral_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='email_normalized',
+            field=models.EmailField(blank=True, editable=False, max_length=254, null=True),
+        ),
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+        # Built once over the backfilled column rather than maintained row by row.
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['email_normalized'], name='user_email_normalized_idx'),
+        ),
+    ]
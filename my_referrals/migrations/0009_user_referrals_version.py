@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_referrals', '0008_referralevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='referrals_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,26 +1,210 @@
+import time
 import uuid
+from contextlib import nullcontext
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
 
-from .utils import get_code_expiration_time, generate_code
+from .constants import REFERRAL_CODE_GENERATION_ATTEMPTS, REFERRAL_CODE_MAX_LENGTH
+from .utils import get_code_expiration_time, generate_code, normalize_email_address
 
 
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     referrer = models.ForeignKey('self', null=True, related_name='referrals', on_delete=models.SET_NULL)
+    # Denormalized counters kept up to date by my_referrals.tree
+    direct_referrals_count = models.PositiveIntegerField(default=0, editable=False)
+    total_referrals_count = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped whenever the user's referral listing changes, to tell clients
+    # polling the listing whether it is still current (see my_referrals.conditional)
+    referrals_version = models.PositiveIntegerField(default=0, editable=False)
+    # Trimmed, lowercased email, which lookups by email go through
+    email_normalized = models.EmailField(null=True, blank=True, editable=False)
+
+    COUNTER_FIELDS = ('direct_referrals_count', 'total_referrals_count', 'referrals_version')
+    # Fields the referrer's listing shows or is ordered by
+    LISTED_FIELDS = ('username', 'date_joined', 'referrer_id')
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['email_normalized'], name='user_email_normalized_idx'),
+            # Serves the keyset-paginated referral list in a single range scan.
+            models.Index(fields=['referrer', 'date_joined', 'id'], name='user_referrer_joined_idx'),
+            # Serve the leaderboard as a scan of the first N index entries.
+            models.Index(fields=['-direct_referrals_count', 'id'], name='user_direct_referrals_idx'),
+            models.Index(fields=['-total_referrals_count', 'id'], name='user_total_referrals_idx'),
+        ]
 
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # The email as loaded, to tell on save whether lookups by email have to be invalidated
+        user._loaded_email = user.__dict__.get('email_normalized')
+        # Likewise for the referrer's listing
+        user._loaded_listing = user.listed_values()
+        return user
+
+    def listed_values(self):
+        return tuple(self.__dict__.get(attname) for attname in self.LISTED_FIELDS)
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and not kwargs.get('force_insert') and not self._state.adding:
+            # The counters are only ever changed by UPDATE ... SET n = n + 1: a
+            # full save leaves them out rather than write back stale values.
+            skipped = {*self.COUNTER_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.attname not in skipped]
+        self.email_normalized = normalize_email_address(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'email_normalized'}
+        # The listings of the old and new referrer change if a listed field is
+        # saved with a new value (assumed for instances not loaded from the database).
+        saves_listing = update_fields is None or not {'referrer', *self.LISTED_FIELDS}.isdisjoint(update_fields)
+        loaded_listing = getattr(self, '_loaded_listing', None)
+        referrer_ids = set()
+        if saves_listing and not self._state.adding and loaded_listing != self.listed_values():
+            referrer_ids = {self.referrer_id, loaded_listing and loaded_listing[-1]} - {None}
+        with transaction.atomic() if referrer_ids else nullcontext():
+            super().save(*args, **kwargs)
+            if referrer_ids:
+                User.objects.filter(pk__in=referrer_ids).update(referrals_version=F('referrals_version') + 1)
+        if saves_listing:
+            self._loaded_listing = self.listed_values()
+
+
+class ReferralCodeManager(models.Manager):
+    def touch_referrer(self, user_id):
+        """
+        Bumps the listing version of the user's referrer, whose listing shows
+        the user's code.
+        """
+        User.objects.filter(referrals=user_id).update(referrals_version=F('referrals_version') + 1)
+
+    def rotate(self, user_id):
+        """
+        Gives the user a fresh code and expiration date. For a user who already
+        has a code this is a single UPDATE of the existing row; otherwise the row
+        is inserted. A collision on the unique code, or a concurrent rotation
+        inserting the user's row first, is retried with a newly generated code.
+        """
+        for attempt in range(REFERRAL_CODE_GENERATION_ATTEMPTS):
+            referral_code = self.model(
+                user_id=user_id, code=generate_code(), expiration_date=get_code_expiration_time())
+            try:
+                # The referrer's listing shows the new code under a new version
+                # or not at all; a collision rolls back only this attempt.
+                with transaction.atomic():
+                    updated = self.filter(user_id=user_id).update(
+                        code=referral_code.code, expiration_date=referral_code.expiration_date)
+                    if not updated:
+                        referral_code.save(force_insert=True)
+                    self.touch_referrer(user_id)
+            except IntegrityError:
+                if attempt == REFERRAL_CODE_GENERATION_ATTEMPTS - 1:
+                    raise
+                continue
+            return referral_code
+
+    async def arotate(self, user_id):
+        # The async ORM cannot open transactions, so rotate() runs in a worker thread.
+        return await sync_to_async(self.rotate)(user_id)
+
+    def discard(self, user_id):
+        """
+        Deletes the user's code, together with the version bump of the
+        referrer's listing. Returns whether the user had a code.
+        """
+        with transaction.atomic():
+            deleted, _ = self.filter(user_id=user_id).delete()
+            if deleted:
+                self.touch_referrer(user_id)
+        return bool(deleted)
+
+    async def adiscard(self, user_id):
+        return await sync_to_async(self.discard)(user_id)
+
+    def purge_expired(self, batch_size, pause=0.0):
+        """
+        Deletes expired codes in batches of at most batch_size rows, walking the
+        primary key in ascending ranges so that each DELETE locks a short, bounded
+        stretch of the table. Sleeps pause seconds between batches to let replicas
+        catch up. Yields the number of codes deleted by each batch.
+        """
+        now = timezone.now()
+        last_pk = 0
+        while True:
+            pks = list(
+                self.filter(expiration_date__lt=now, pk__gt=last_pk)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                return
+            deleted, _ = self.filter(pk__gte=pks[0], pk__lte=pks[-1], expiration_date__lt=now).delete()
+            last_pk = pks[-1]
+            yield deleted
+            if len(pks) < batch_size:
+                return
+            if pause:
+                time.sleep(pause)
+
 
 class ReferralCode(models.Model):
     user = models.OneToOneField('User', on_delete=models.CASCADE)
-    code = models.CharField(unique=True, max_length=200)
-    expiration_date = models.DateTimeField(null=True, blank=True)
+    code = models.CharField(unique=True, max_length=REFERRAL_CODE_MAX_LENGTH)
+    expiration_date = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = ReferralCodeManager()
 
     def save(self, *args, **kwargs):
         if not self.pk:
-            self.expiration_date = get_code_expiration_time()
-            self.code = generate_code()
+            if self.expiration_date is None:
+                self.expiration_date = get_code_expiration_time()
+            if not self.code:
+                self.code = generate_code()
         super().save(*args, **kwargs)
 
+
+class ReferralTreePath(models.Model):
+    """
+    Closure table of the referral tree: one row per (ancestor, descendant) pair,
+    depth 1 meaning a direct referral. Maintained by my_referrals.tree.
+    """
+    ancestor = models.ForeignKey('User', related_name='descendant_paths', on_delete=models.CASCADE)
+    descendant = models.ForeignKey('User', related_name='ancestor_paths', on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='referral_path_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['ancestor', 'depth'], name='referral_path_subtree_idx'),
+            models.Index(fields=['descendant', 'depth'], name='referral_path_ancestors_idx'),
+        ]
+
+
+class ReferralEvent(models.Model):
+    """
+    Transactional outbox of referral events: written in the same transaction as
+    the change it describes, delivered to the sinks of REFERRAL_EVENT_SINKS by
+    the drain_referral_events command and deleted once delivered.
+    """
+    USER_REFERRED = 'user.referred'
+
+    event_type = models.CharField(max_length=64)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def to_message(self):
+        return {
+            'id': self.pk,
+            'type': self.event_type,
+            'payload': self.payload,
+            'created_at': self.created_at.isoformat(),
+        }
@@ -0,0 +1,79 @@
+import json
+import os
+import queue
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import ReferralEvent
+
+# Events delivered by LocalQueueSink, for consumers running in the draining process
+local_queue = queue.Queue()
+
+
+class JSONLFileSink:
+    """
+    Appends events to a JSON lines file, synced to disk before the events are
+    removed from the outbox.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, messages):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.writelines(json.dumps(message) + '\n' for message in messages)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class LocalQueueSink:
+    """
+    Puts events on local_queue.
+    """
+    def send(self, messages):
+        for message in messages:
+            local_queue.put(message)
+
+
+def get_sinks():
+    return [
+        import_string(sink['BACKEND'])(**sink.get('OPTIONS', {}))
+        for sink in getattr(settings, 'REFERRAL_EVENT_SINKS', [])
+    ]
+
+
+def record_referrals(users):
+    """
+    Adds a user.referred event for each of the users who has a referrer. Must
+    run in the transaction inserting the users, so events exist exactly for the
+    users that were committed.
+    """
+    ReferralEvent.objects.bulk_create([
+        ReferralEvent(event_type=ReferralEvent.USER_REFERRED, payload={
+            'user': str(user.pk),
+            'username': user.username,
+            'referrer': str(user.referrer_id),
+            'registered_at': user.date_joined.isoformat(),
+        })
+        for user in users if user.referrer_id
+    ])
+
+
+def drain(sinks, batch_size):
+    """
+    Delivers the oldest batch of events to every sink and deletes it, returning
+    the number of events delivered. Rows are locked with SKIP LOCKED, so several
+    workers can drain at once. If a sink fails the batch is rolled back and
+    retried later, so delivery is at least once: consumers should deduplicate
+    on the event id.
+    """
+    with transaction.atomic():
+        events = list(ReferralEvent.objects.select_for_update(skip_locked=True).order_by('pk')[:batch_size])
+        if not events:
+            return 0
+        messages = [event.to_message() for event in events]
+        for sink in sinks:
+            sink.send(messages)
+        ReferralEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+    return len(events)
@@ -0,0 +1,121 @@
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .constants import REFERRALS_PAGE_SIZE, REFERRALS_MAX_PAGE_SIZE
+
+
+def encode_cursor(date_joined, pk):
+    raw = f"{date_joined.isoformat()}|{pk.hex}".encode()
+    return urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_joined, pk = raw.split('|')
+        return datetime.fromisoformat(date_joined), uuid.UUID(pk)
+    except (BinasciiError, UnicodeDecodeError, ValueError):
+        raise NotFound("Invalid cursor.")
+
+
+def position_of(row):
+    """
+    (date_joined, id) of a row, which is either a model instance or a dict
+    from values().
+    """
+    if isinstance(row, dict):
+        return row['date_joined'], row['id']
+    return row.date_joined, row.id
+
+
+def keyset_filter(queryset, position):
+    """
+    Narrows an ordered queryset down to the rows that come after position,
+    a (date_joined, id) pair of the last row already seen.
+    """
+    if position is None:
+        return queryset
+    date_joined, pk = position
+    return queryset.filter(Q(date_joined__gt=date_joined) | Q(date_joined=date_joined, id__gt=pk))
+
+
+def iterate_in_chunks(queryset, chunk_size, ordering=('date_joined', 'id')):
+    """
+    Yields every row of the queryset, fetching chunk_size rows per query with
+    the same keyset filter the paginator uses, so memory stays flat even on
+    backends that buffer whole result sets client-side (MySQL).
+    """
+    queryset = queryset.order_by(*ordering)
+    position = None
+    while True:
+        rows = list(keyset_filter(queryset, position)[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        position = position_of(rows[-1])
+
+
+class ReferralCursorPagination(BasePagination):
+    """
+    Keyset pagination over (date_joined, id). Every page is one range scan of
+    the (referrer, date_joined, id) index, however deep the client pages.
+    """
+    ordering = ('date_joined', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, query_params):
+        try:
+            page_size = int(query_params.get(self.page_size_query_param, REFERRALS_PAGE_SIZE))
+        except ValueError:
+            page_size = REFERRALS_PAGE_SIZE
+        return min(max(page_size, 1), REFERRALS_MAX_PAGE_SIZE)
+
+    def prepare(self, queryset, request):
+        """
+        Reads page size and cursor from the request (a DRF or a plain Django
+        one) and returns the query of the page plus one row, which tells
+        whether there is a next page.
+        """
+        self.request = request
+        query_params = getattr(request, 'query_params', request.GET)
+        self.page_size = self.get_page_size(query_params)
+
+        cursor = query_params.get(self.cursor_query_param)
+        position = decode_cursor(cursor) if cursor else None
+        return keyset_filter(queryset.order_by(*self.ordering), position)[:self.page_size + 1]
+
+    def finish(self, rows):
+        self.has_next = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        self.last_position = position_of(page[-1]) if page else None
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish(list(self.prepare(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        return self.finish([row async for row in self.prepare(queryset, request)])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(*self.last_position))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
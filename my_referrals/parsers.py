@@ -0,0 +1,33 @@
+import io
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from .renderers import orjson
+
+# Maps digits to "0" and every other byte to "x", so that integers too wide
+# for orjson show up as runs of WIDE_NUMBER (a translate and a substring search
+# are several times faster than a regular expression).
+DIGITS = bytes(b'0'[0] if byte in b'0123456789' else b'x'[0] for byte in range(256))
+WIDE_NUMBER = b'0' * 20
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser decoding with orjson when it is installed. Bodies in encodings
+    other than UTF-8, which orjson doesn't read, are left to JSONParser, as is
+    everything when orjson isn't installed.
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        content = stream.read()
+        if WIDE_NUMBER in content.translate(DIGITS):
+            # orjson would read integers wider than 64 bits as floats.
+            return super().parse(io.BytesIO(content), media_type, parser_context)
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
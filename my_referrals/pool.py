@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    Process-wide set of idle database connections. Connections are handed out
+    most recently used first and are dropped once they are older than
+    max_lifetime seconds or fail the health check.
+    """
+    def __init__(self, size, max_lifetime):
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def expired(self, created_at):
+        return self.max_lifetime is not None and time.monotonic() - created_at >= self.max_lifetime
+
+    def acquire(self, check):
+        """
+        Returns an idle connection that passes check(connection) and its
+        creation time, or (None, None) if there is none.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None, None
+                connection, created_at = self._idle.pop()
+            if not self.expired(created_at) and check(connection):
+                return connection, created_at
+            close_quietly(connection)
+
+    def release(self, connection, created_at):
+        with self._lock:
+            if len(self._idle) < self.size and not self.expired(created_at):
+                self._idle.append((connection, created_at))
+                return
+        close_quietly(connection)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            close_quietly(connection)
+
+    def __len__(self):
+        return len(self._idle)
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Database backend mixin returning connections to a ConnectionPool when
+    Django closes them (at the end of every request with CONN_MAX_AGE=0)
+    and reusing them for new ones, so requests don't pay for the connection
+    setup. Configured by the POOL entry of the database settings:
+    SIZE (idle connections kept per process) and MAX_LIFETIME (seconds).
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+    pool_created_at = None
+
+    @property
+    def pool(self):
+        with self._pools_lock:
+            if self.alias not in self._pools:
+                options = self.settings_dict.get('POOL', {})
+                self._pools[self.alias] = ConnectionPool(options.get('SIZE', 10), options.get('MAX_LIFETIME', 3600))
+            return self._pools[self.alias]
+
+    def check_pooled_connection(self, connection):
+        """
+        Health check run on an idle connection before it is reused.
+        """
+        return True
+
+    def get_new_connection(self, conn_params):
+        connection, created_at = self.pool.acquire(self.check_pooled_connection)
+        if connection is None:
+            connection, created_at = super().get_new_connection(conn_params), time.monotonic()
+        self.pool_created_at = created_at
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.in_atomic_block:
+            # Django keeps the wrapper bound to this connection until the block
+            # exits, so it can't be shared.
+            return super()._close()
+        try:
+            # Discard anything left uncommitted, so the next user starts clean.
+            self.connection.rollback()
+        except Exception:
+            return close_quietly(self.connection)
+        self.pool.release(self.connection, self.pool_created_at)
+
+
+def _forget_pools_after_fork():
+    # A forked worker must not share the parent's sockets, nor close them.
+    PooledDatabaseWrapperMixin._pools = {}
+    PooledDatabaseWrapperMixin._pools_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pools_after_fork)
@@ -0,0 +1,144 @@
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .constants import REGISTRATION_INSERT_BATCH_SIZE
+from .models import ReferralCode, User
+from .outbox import record_referrals
+from .serializers import UserImportSerializer
+from .tree import link_referrals
+from .utils import normalize_code, normalize_email_address
+
+
+def format_errors(errors):
+    return "; ".join(f"{field}: {' '.join(str(message) for message in messages)}"
+                     for field, messages in errors.items())
+
+
+def hash_passwords(passwords, executor=None):
+    """
+    Hashes passwords in order, spreading the work over executor (e.g. a process
+    pool) when one is given.
+    """
+    if executor is None:
+        return [make_password(password) for password in passwords]
+    chunksize = max(len(passwords) // (getattr(executor, '_max_workers', 1) * 4), 1)
+    return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def resolve_referral_codes(codes):
+    """
+    Maps each referral code to its owner's id (or an error message) with a
+    single code__in query.
+    """
+    normalized = {code: normalize_code(code) for code in codes}
+    found = {
+        code: (user_id, expiration_date)
+        for code, user_id, expiration_date in ReferralCode.objects.filter(
+            code__in={code for code in normalized.values() if code}).values_list(
+            'code', 'user_id', 'expiration_date')
+    }
+    now = timezone.now()
+    resolved = {}
+    for code in codes:
+        stored_code = normalized[code]
+        if stored_code not in found:
+            resolved[code] = (None, "This referral code does not exist")
+        elif found[stored_code][1] <= now:
+            resolved[code] = (None, "Referral code has expired")
+        else:
+            resolved[code] = (found[stored_code][0], None)
+    return resolved
+
+
+def insert_users(users, batch_size):
+    """
+    Inserts users with bulk_create. If the batch hits a unique constraint (a
+    username registered concurrently) the rows are retried one by one so the
+    error is reported for the offending row only. Returns the rows that failed
+    as {user: error}.
+    """
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=batch_size)
+            link_referrals(users)
+            record_referrals(users)
+        return {}
+    except IntegrityError:
+        pass
+
+    failed = {}
+    inserted = []
+    with transaction.atomic():
+        for user in users:
+            try:
+                with transaction.atomic():
+                    user.save(force_insert=True)
+            except IntegrityError as e:
+                if User.objects.filter(username=user.username).exists():
+                    failed[user] = "User with this username already exists!"
+                else:
+                    failed[user] = str(e)
+            else:
+                inserted.append(user)
+        link_referrals(inserted)
+        record_referrals(inserted)
+    return failed
+
+
+def register_users(rows, batch_size=REGISTRATION_INSERT_BATCH_SIZE, executor=None):
+    """
+    Registers a batch of users, each row being a dict like the body of the
+    register endpoint. Invalid rows are reported and skipped without aborting
+    the rest of the batch. Returns one result per row, in order: {"username",
+    "id"} for created users and {"username", "error"} for rejected ones.
+    """
+    results = [None] * len(rows)
+    valid = {}
+    for index, row in enumerate(rows):
+        serializer = UserImportSerializer(data=row)
+        if serializer.is_valid():
+            valid[index] = serializer.validated_data
+        else:
+            username = row.get('username') if isinstance(row, dict) else None
+            results[index] = {"username": username, "error": format_errors(serializer.errors)}
+
+    seen = set()
+    for index, data in list(valid.items()):
+        if data['username'] in seen:
+            results[index] = {"username": data['username'], "error": "Duplicate username in batch!"}
+            del valid[index]
+        seen.add(data['username'])
+
+    existing = set(User.objects.filter(username__in=seen).values_list('username', flat=True))
+    codes = resolve_referral_codes({data['referral_code'] for data in valid.values() if data.get('referral_code')})
+
+    for index, data in list(valid.items()):
+        error = None
+        if data['username'] in existing:
+            error = "User with this username already exists!"
+        elif data.get('referral_code'):
+            error = codes[data['referral_code']][1]
+        if error:
+            results[index] = {"username": data['username'], "error": error}
+            del valid[index]
+
+    passwords = hash_passwords([data['password'] for data in valid.values()], executor)
+    users = {}
+    for (index, data), password in zip(valid.items(), passwords):
+        referral_code = data.get('referral_code')
+        users[index] = User(
+            username=User.normalize_username(data['username']),
+            email=User.objects.normalize_email(data.get('email') or ''),
+            email_normalized=normalize_email_address(data.get('email')),
+            password=password,
+            referrer_id=codes[referral_code][0] if referral_code else None,
+        )
+
+    failed = insert_users(list(users.values()), batch_size)
+    for index, user in users.items():
+        if user in failed:
+            results[index] = {"username": user.username, "error": failed[user]}
+        else:
+            results[index] = {"username": user.username, "id": user.pk}
+    return results
@@ -0,0 +1,84 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# Replica alias reads of the current request are routed to, if any
+_replica = ContextVar('replica', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def pin_key(user_id):
+    return f"replica_pin:{user_id}"
+
+
+def pin_to_primary(*user_ids):
+    """
+    Keeps reads concerning these users on the primary for
+    REPLICA_STICKINESS_SECONDS after a write, until replicas have caught up.
+    Pins live in the default cache, so it must be shared by all workers.
+    """
+    timeout = settings.REPLICA_STICKINESS_SECONDS
+    if get_replicas() and timeout > 0:
+        cache.set_many({pin_key(user_id): True for user_id in user_ids if user_id}, timeout)
+
+
+async def apin_to_primary(*user_ids):
+    timeout = settings.REPLICA_STICKINESS_SECONDS
+    if get_replicas() and timeout > 0:
+        await cache.aset_many({pin_key(user_id): True for user_id in user_ids if user_id}, timeout)
+
+
+def is_pinned(*user_ids):
+    if not get_replicas():
+        return False
+    return bool(cache.get_many([pin_key(user_id) for user_id in user_ids if user_id]))
+
+
+@contextmanager
+def read_from_replica(*user_ids):
+    """
+    Routes the reads made in the block to a randomly chosen replica (the same
+    one for the whole block), unless one of the given users is pinned to the
+    primary by a recent write.
+    """
+    replicas = get_replicas()
+    replica = random.choice(replicas) if replicas and not is_pinned(*user_ids) else None
+    token = _replica.set(replica)
+    try:
+        yield replica
+    finally:
+        _replica.reset(token)
+
+
+def read_alias():
+    """
+    Alias reads are currently routed to. Querysets evaluated after the block
+    has exited (e.g. by a streaming response) must be bound to it explicitly.
+    """
+    return _replica.get() or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """
+    Sends reads made inside read_from_replica() to a replica and everything
+    else, writes included, to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        # Objects read from a replica are still saved to the primary.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in get_replicas() else None
@@ -0,0 +1,83 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import close_old_connections
+
+from .constants import EXPIRED_CODES_PURGE_BATCH_SIZE, EXPIRED_CODES_PURGE_PAUSE_IN_SECONDS
+from .models import ReferralCode
+
+logger = logging.getLogger(__name__)
+
+# Cache key of the lock letting a single worker purge per interval
+PURGE_LOCK_KEY = 'referral_code_purge_lock'
+
+_sweeper = None
+_lock = threading.Lock()
+
+
+class ExpiredCodeSweeper(threading.Thread):
+    """
+    Daemon thread purging expired referral codes every interval seconds, for
+    deployments that would rather not schedule purge_expired_codes externally.
+    Every worker runs one, but a lock in the default cache (which must be
+    shared by all workers) lets only one of them purge per interval.
+    """
+    def __init__(self, interval):
+        super().__init__(name='expired-code-sweeper', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Purging expired referral codes failed.")
+            finally:
+                close_old_connections()
+
+    def sweep(self):
+        """
+        Purges expired codes unless another worker has done so in the current
+        interval. Returns the number of codes deleted, or None if skipped.
+        """
+        if not cache.add(PURGE_LOCK_KEY, True, self.interval):
+            return None
+        deleted = sum(ReferralCode.objects.purge_expired(
+            EXPIRED_CODES_PURGE_BATCH_SIZE, EXPIRED_CODES_PURGE_PAUSE_IN_SECONDS))
+        logger.info("Deleted %d expired referral codes.", deleted)
+        return deleted
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_sweeper(**kwargs):
+    """
+    Starts the sweeper in the current process if REFERRAL_CODE_PURGE_INTERVAL
+    is set and it isn't running already. Connected to request_started by
+    install_sweeper(), so that it starts in the processes serving requests.
+    """
+    global _sweeper
+    interval = getattr(settings, 'REFERRAL_CODE_PURGE_INTERVAL', 0)
+    if interval <= 0 or (_sweeper is not None and _sweeper.is_alive()):
+        return _sweeper
+    with _lock:
+        # Not running in a process forked from one where it was started either.
+        if _sweeper is None or not _sweeper.is_alive():
+            _sweeper = ExpiredCodeSweeper(interval)
+            _sweeper.start()
+    return _sweeper
+
+
+def install_sweeper():
+    """
+    Called from the WSGI/ASGI entry points, so management commands never start
+    the sweeper. It starts on the first request rather than at import: a
+    preforking server (e.g. gunicorn --preload) imports the application in its
+    master, and the thread would stay there instead of running in the workers.
+    """
+    request_started.connect(start_sweeper, dispatch_uid='expired-code-sweeper')
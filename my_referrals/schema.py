@@ -0,0 +1,39 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag, require_safe
+
+
+@functools.cache
+def load_schema(path):
+    """
+    Reads the pre-generated schema once per process and returns it with its ETag.
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    return content, hashlib.sha1(content).hexdigest()
+
+
+def get_schema_etag(request):
+    try:
+        return load_schema(settings.API_SCHEMA_FILE)[1]
+    except FileNotFoundError:
+        return None
+
+
+@require_safe
+@cache_control(public=True, max_age=settings.API_SCHEMA_CACHE_TIMEOUT)
+@etag(get_schema_etag)
+def schema_file_view(request):
+    """
+    Serves the OpenAPI schema written by the generate_schema command from memory,
+    answering revalidations with 304 Not Modified.
+    """
+    try:
+        content, _ = load_schema(settings.API_SCHEMA_FILE)
+    except FileNotFoundError:
+        raise Http404("The API schema has not been generated.")
+    return HttpResponse(content, content_type='application/json')
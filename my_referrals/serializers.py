@@ -1,10 +1,17 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, FilteredRelation, Q
 from rest_framework import status
 from rest_framework.serializers import ModelSerializer
 from django.utils import timezone
-from rest_framework.serializers import CharField
+from rest_framework.serializers import CharField, DateTimeField
 
+from .cache import get_code_by_code
 from .models import *
+from .outbox import record_referrals
+from .tree import link_referrals
 
 
 class UserSerializer(ModelSerializer):
@@ -13,33 +20,105 @@ class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'password', "email", "referral_code"]
-        extra_kwargs = {'email': {'write_only': True}, 'password': {'write_only': True}}
+        extra_kwargs = {
+            'email': {'write_only': True},
+            'password': {'write_only': True},
+            # Uniqueness is left to the database constraint instead of a SELECT per registration.
+            'username': {'validators': [UnicodeUsernameValidator()]},
+        }
 
     def create(self, validated_data):
         password = validated_data.pop('password')
+        # Passed to save() by views that hash the password off the request thread.
+        encoded_password = validated_data.pop('encoded_password', None) or make_password(password)
         referral_code = validated_data.pop('referral_code', None)
         email = validated_data.pop('email', None)
-        referrer = None
+        referrer_id = None
 
         if referral_code:
-            try:
-                check_code = ReferralCode.objects.get(code=referral_code)
-                if check_code.expiration_date > timezone.now():
-                    referrer = check_code.user
-                else:
-                    raise ValidationError("Referral code has expired", code=status.HTTP_400_BAD_REQUEST)
-            except ReferralCode.DoesNotExist:
+            check_code = get_code_by_code(referral_code)
+            if check_code is None:
                 raise ValidationError("This referral code does not exist", code=status.HTTP_400_BAD_REQUEST)
+            if check_code.expiration_date > timezone.now():
+                referrer_id = check_code.user_id
+            else:
+                raise ValidationError("Referral code has expired", code=status.HTTP_400_BAD_REQUEST)
 
-        user = User.objects.create_user(**validated_data, password=password, email=email)
-        if referrer:
-            user.referrer = referrer
+        # Built the way create_user() builds it, with the password already hashed.
+        user = User(username=User.normalize_username(validated_data['username']),
+                    email=User.objects.normalize_email(email), password=encoded_password, referrer_id=referrer_id)
+        if not referrer_id:
             user.save()
+            return user
 
+        with transaction.atomic():
+            user.save()
+            link_referrals([user])
+            record_referrals([user])
         return user
 
 
+class UserImportSerializer(ModelSerializer):
+    """
+    Validates one row of a bulk registration. Username uniqueness and referral
+    codes are checked for the whole batch at once in my_referrals.registration,
+    so no validator here touches the database.
+    """
+    referral_code = CharField(max_length=255, required=False, allow_blank=True)
+
+    class Meta:
+        model = User
+        fields = ['username', 'password', "email", "referral_code"]
+        extra_kwargs = {'username': {'validators': [UnicodeUsernameValidator()]}}
+
+
 class ReferralCodeSerializer(ModelSerializer):
     class Meta:
         model = ReferralCode
         fields = ['user', 'code', 'expiration_date']
+
+
+class ReferralListSerializer:
+    """
+    Read-only serializer of the referral listings. Renders the rows of
+    ReferralListSerializer.project(queryset) by building the dicts directly,
+    skipping the per-field machinery of a ModelSerializer, which dominates the
+    cost of large pages and streams.
+    """
+    fields = ('username', 'referral_code', 'referral_code_expiration_date')
+    expiration_field = DateTimeField()
+
+    @classmethod
+    def project(cls, queryset):
+        """
+        Selects only the rendered columns plus the (date_joined, id) pagination
+        key. Each referral's code comes from the same query, through a LEFT JOIN
+        that leaves expired codes out, so a page costs one query whatever its size.
+        """
+        return queryset.annotate(
+            active_code=FilteredRelation('referralcode', condition=Q(referralcode__expiration_date__gte=timezone.now())),
+        ).values(
+            'username', 'date_joined', 'id',
+            referral_code=F('active_code__code'),
+            referral_code_expiration_date=F('active_code__expiration_date'),
+        )
+
+    def __init__(self, instance=None, many=False):
+        self.instance = instance
+        self.many = many
+
+    def to_representation(self, row):
+        expiration_date = row['referral_code_expiration_date']
+        return {
+            'username': row['username'],
+            'referral_code': row['referral_code'],
+            # Formatted like ReferralCodeSerializer formats it.
+            'referral_code_expiration_date':
+                self.expiration_field.to_representation(expiration_date) if expiration_date else None,
+        }
+
+    @property
+    def data(self):
+        if self.many:
+            return [self.to_representation(row) for row in self.instance]
+        return self.to_representation(self.instance)
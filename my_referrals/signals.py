@@ -0,0 +1,26 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_user_codes
+from .models import User
+from .tree import detach_subtree
+
+MISSING = object()
+
+
+@receiver(pre_delete, sender=User)
+def detach_deleted_user(sender, instance, **kwargs):
+    detach_subtree(instance)
+    invalidate_user_codes(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidate_changed_email(sender, instance, created, update_fields, **kwargs):
+    if update_fields is not None and 'email_normalized' not in update_fields:
+        return
+    # A user that wasn't loaded from the database may have changed its email too.
+    if not created and getattr(instance, '_loaded_email', MISSING) != instance.email_normalized:
+        # Replacing the user's generation stales the old email's lookup; the new
+        # email's may hold the code of another user with that email.
+        invalidate_user_codes(instance.pk, emails=[instance.email_normalized])
+    instance._loaded_email = instance.email_normalized
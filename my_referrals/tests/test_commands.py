@@ -0,0 +1,185 @@
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.http import Http404
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .. import outbox, scheduler, schema
+from ..models import ReferralCode, ReferralEvent, User
+from ..registration import register_users
+
+
+class ImportUsersCommandTestCase(TestCase):
+    def setUp(self):
+        self.referrer = User.objects.create_user(username='vladimir', password='password666')
+        self.code = ReferralCode.objects.create(user=self.referrer)
+
+    def import_users(self, content, suffix, *args):
+        stdout, stderr = StringIO(), StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix=suffix) as file:
+            file.write(content)
+            file.flush()
+            call_command('import_users', file.name, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_jsonl(self):
+        rows = [
+            {'username': 'first', 'password': 'password666', 'referral_code': self.code.code},
+            {'username': 'vladimir', 'password': 'password666'},
+            {'username': 'second', 'password': 'password666'},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        stdout, stderr = self.import_users(content, '.jsonl', '--batch-size', '2')
+        self.assertIn('Imported 2 users, 2 rows failed.', stdout)
+        self.assertIn('line 2: vladimir: User with this username already exists!', stderr)
+        self.assertIn('line 4: Invalid JSON', stderr)
+        self.assertEqual(User.objects.get(username='first').referrer, self.referrer)
+
+    def test_import_csv_with_process_pool(self):
+        content = 'username,password,email\nfirst,password666,first@gmail.com\nsecond,password666,\n'
+        stdout, _ = self.import_users(content, '.csv', '--workers', '2')
+        self.assertIn('Imported 2 users, 0 rows failed.', stdout)
+        self.assertTrue(User.objects.get(username='second').check_password('password666'))
+
+
+class PurgeExpiredCodesCommandTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            user = User.objects.create(username=f'user{i}')
+            expiration_date = now - timedelta(days=1) if i % 2 == 0 else now + timedelta(days=1)
+            ReferralCode.objects.create(user=user, expiration_date=expiration_date)
+
+    def test_purge_expired_codes(self):
+        stdout = StringIO()
+        call_command('purge_expired_codes', '--batch-size', '2', '--sleep', '0', stdout=stdout)
+        self.assertIn('Deleted 3 expired referral codes.', stdout.getvalue())
+        self.assertEqual(ReferralCode.objects.count(), 2)
+        self.assertFalse(ReferralCode.objects.filter(expiration_date__lt=timezone.now()).exists())
+
+    def test_purge_expired_yields_bounded_batches(self):
+        self.assertEqual(list(ReferralCode.objects.purge_expired(batch_size=2)), [2, 1])
+
+    def test_sweepers_purge_once_per_interval(self):
+        cache.delete(scheduler.PURGE_LOCK_KEY)
+        sweepers = [scheduler.ExpiredCodeSweeper(interval=60) for _ in range(2)]
+        self.assertEqual([sweeper.sweep() for sweeper in sweepers], [3, None])
+
+    @override_settings(REFERRAL_CODE_PURGE_INTERVAL=60)
+    def test_sweeper_starts_with_the_first_request(self):
+        with mock.patch.object(scheduler.ExpiredCodeSweeper, 'start') as start, \
+                mock.patch.object(scheduler, '_sweeper', None):
+            scheduler.install_sweeper()
+            self.addCleanup(request_started.disconnect, dispatch_uid='expired-code-sweeper')
+            start.assert_not_called()
+            self.client.get('/metrics/')
+            start.assert_called_once()
+
+
+class LoadtestCommandTestCase(TestCase):
+    def test_seed_record_replay(self):
+        call_command('loadtest', 'seed', '--users', '20', '--referrers', '3', stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='loadtest_').count(), 23)
+        self.assertEqual(User.objects.get(username='loadtest_0').direct_referrals_count
+                         + User.objects.get(username='loadtest_1').direct_referrals_count
+                         + User.objects.get(username='loadtest_2').direct_referrals_count, 20)
+
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as file:
+            call_command('loadtest', 'record', file.name, '--requests', '30', '--seed', '1',
+                         '--mix', 'ref_code=1,ref_code_by_email=1,referrals_list=1', stdout=StringIO())
+            with open(file.name) as trace:
+                entries = [json.loads(line) for line in trace]
+            self.assertEqual(len(entries), 30)
+            self.assertEqual(entries[0]['request_id'], 'req-000000')
+
+            stdout = StringIO()
+            call_command('loadtest', 'replay', file.name, '--concurrency', '1', stdout=stdout)
+
+        report = {line.split()[0]: line.split()[1:] for line in stdout.getvalue().splitlines()[1:]}
+        self.assertEqual(report['total'][0], '30')
+        self.assertEqual(report['total'][-1], '0')
+
+
+class BenchmarkDbConnectionsCommandTestCase(TransactionTestCase):
+    # The command closes connections, which a test transaction wouldn't survive.
+    def test_benchmark_reports_connects_per_mode(self):
+        stdout = StringIO()
+        call_command('benchmark_db_connections', '--requests', '5', stdout=stdout)
+        rows = {line[:16].strip(): line.split()[-1] for line in stdout.getvalue().splitlines()[1:]}
+        self.assertEqual(set(rows), {'new connection', 'persistent'})
+
+
+class DrainReferralEventsCommandTestCase(TestCase):
+    def setUp(self):
+        self.referrer = User.objects.create_user(username='vladimir', password='password666')
+        self.code = ReferralCode.objects.create(user=self.referrer)
+        register_users([
+            {'username': 'first', 'password': 'password666', 'referral_code': self.code.code},
+            {'username': 'second', 'password': 'password666', 'referral_code': self.code.code},
+            {'username': 'unreferred', 'password': 'password666'},
+        ])
+
+    def test_events_are_written_with_the_users(self):
+        payloads = ReferralEvent.objects.order_by('pk').values_list('payload', flat=True)
+        self.assertEqual([payload['username'] for payload in payloads], ['first', 'second'])
+        self.assertEqual(payloads[0]['referrer'], str(self.referrer.id))
+
+    def test_drain_delivers_to_every_sink_in_batches(self):
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as file, override_settings(REFERRAL_EVENT_SINKS=[
+            {'BACKEND': 'my_referrals.outbox.JSONLFileSink', 'OPTIONS': {'path': file.name}},
+            {'BACKEND': 'my_referrals.outbox.LocalQueueSink'},
+        ]):
+            stdout = StringIO()
+            call_command('drain_referral_events', '--batch-size', '1', stdout=stdout)
+            messages = [json.loads(line) for line in file]
+
+        self.assertIn('Delivered 2 referral events.', stdout.getvalue())
+        self.assertEqual([message['payload']['username'] for message in messages], ['first', 'second'])
+        self.assertEqual(outbox.local_queue.get_nowait(), messages[0])
+        self.assertEqual(outbox.local_queue.get_nowait(), messages[1])
+        self.assertFalse(ReferralEvent.objects.exists())
+
+    def test_failed_delivery_keeps_events(self):
+        sink = outbox.LocalQueueSink()
+        with mock.patch.object(sink, 'send', side_effect=OSError):
+            with self.assertRaises(OSError):
+                outbox.drain([sink], 10)
+        self.assertEqual(ReferralEvent.objects.count(), 2)
+
+
+class BenchmarkReferralListingCommandTestCase(TestCase):
+    def test_benchmark_leaves_no_users_behind(self):
+        stdout = StringIO()
+        call_command('benchmark_referral_listing', '--referrals', '10', stdout=stdout)
+        self.assertEqual([line.split()[0] for line in stdout.getvalue().splitlines()[1:]], ['model', 'values()'])
+        self.assertFalse(User.objects.exists())
+
+
+class GenerateSchemaCommandTestCase(TestCase):
+    def setUp(self):
+        schema.load_schema.cache_clear()
+        self.addCleanup(schema.load_schema.cache_clear)
+
+    def test_generated_schema_is_served_with_etag(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as file, override_settings(API_SCHEMA_FILE=file.name):
+            call_command('generate_schema', stdout=StringIO())
+            self.assertIn('/ref_code/', json.load(file)['paths'])
+
+            response = schema.schema_file_view(RequestFactory().get('/swagger.json'))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('public', response['Cache-Control'])
+            revalidated = schema.schema_file_view(
+                RequestFactory().get('/swagger.json', HTTP_IF_NONE_MATCH=response['ETag']))
+            self.assertEqual(revalidated.status_code, 304)
+
+    @override_settings(API_SCHEMA_FILE='/nonexistent/openapi.json')
+    def test_missing_schema_is_not_found(self):
+        with self.assertRaises(Http404):
+            schema.schema_file_view(RequestFactory().get('/swagger.json'))
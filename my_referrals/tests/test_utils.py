@@ -0,0 +1,122 @@
+import io
+import tempfile
+import unittest
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import SimpleTestCase, override_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .. import parsers, renderers
+from ..pool import ConnectionPool, PooledDatabaseWrapperMixin
+from ..utils import generate_code, normalize_code
+
+
+class ReferralCodeFormatTestCase(SimpleTestCase):
+    def test_generated_code_is_short_and_valid(self):
+        code = generate_code()
+        self.assertEqual(len(code), 11)
+        self.assertEqual(normalize_code(code), code)
+
+    def test_normalize_code_tolerates_formatting(self):
+        code = generate_code()
+        typed = f"{code[:5]}-{code[5:]}".lower().replace('0', 'o').replace('1', 'l')
+        self.assertEqual(normalize_code(f" {typed} "), code)
+
+    def test_normalize_code_rejects_typos(self):
+        code = generate_code()
+        typo = code[:3] + ('A' if code[3] != 'A' else 'B') + code[4:]
+        self.assertIsNone(normalize_code(typo))
+        self.assertIsNone(normalize_code(code[:-1]))
+        self.assertIsNone(normalize_code('not a code'))
+
+    @override_settings(REFERRAL_CODE_FORMAT='hex')
+    def test_hex_codes(self):
+        code = generate_code()
+        self.assertEqual(len(code), 32)
+        self.assertEqual(normalize_code(code.upper()), code)
+
+
+class PooledSQLiteDatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+    pass
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def test_pool_reuses_healthy_connections(self):
+        pool = ConnectionPool(size=1, max_lifetime=60)
+        healthy, expired, extra = mock.Mock(), mock.Mock(), mock.Mock()
+        with mock.patch('my_referrals.pool.time.monotonic', return_value=100):
+            pool.release(expired, 0)
+            expired.close.assert_called_once()
+
+            pool.release(healthy, 90)
+            pool.release(extra, 90)
+            extra.close.assert_called_once()
+            self.assertEqual(pool.acquire(lambda connection: True), (healthy, 90))
+            self.assertEqual(pool.acquire(lambda connection: True), (None, None))
+
+            pool.release(healthy, 90)
+            self.assertEqual(pool.acquire(lambda connection: False), (None, None))
+            healthy.close.assert_called_once()
+
+    def test_wrapper_returns_connections_to_pool(self):
+        with tempfile.NamedTemporaryFile(suffix='.sqlite3') as file:
+            wrapper = PooledSQLiteDatabaseWrapper({
+                'ENGINE': 'django.db.backends.sqlite3', 'NAME': file.name, 'CONN_MAX_AGE': 0,
+                'CONN_HEALTH_CHECKS': False, 'AUTOCOMMIT': True, 'OPTIONS': {}, 'TIME_ZONE': None,
+                'POOL': {'SIZE': 2, 'MAX_LIFETIME': 60},
+            }, alias='pool_test')
+            self.addCleanup(PooledDatabaseWrapperMixin._pools.pop, 'pool_test')
+            wrapper.ensure_connection()
+            raw = wrapper.connection
+            wrapper.close()
+            self.assertEqual(len(wrapper.pool), 1)
+
+            wrapper.ensure_connection()
+            self.assertIs(wrapper.connection, raw)
+            wrapper.pool.size = 0
+            wrapper.close()
+            self.assertEqual(len(wrapper.pool), 0)
+
+
+class FastJSONTestCase(SimpleTestCase):
+    data = {
+        'id': uuid.UUID('7d0b3c0e-8a2f-4c1e-9d3b-2f6a1e5c4b7a'),
+        'expiration_date': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        'registered_at': [
+            datetime(2024, 5, 1, 15, 30, tzinfo=timezone(timedelta(hours=3))),
+            datetime(2024, 5, 1, 12, 30),
+            date(2024, 5, 1),
+        ],
+        'reward': Decimal('1.50'),
+        'big': 2 ** 70,
+        'separators': 'a\u2028b\u2029c',
+        'username': 'владимир',
+        'referrals': [None, True, 3],
+    }
+
+    def assert_same_as_drf(self):
+        content = renderers.FastJSONRenderer().render(self.data, 'application/json')
+        self.assertEqual(content, JSONRenderer().render(self.data, 'application/json'))
+        parsed = parsers.FastJSONParser().parse(io.BytesIO(content), 'application/json', {'encoding': 'utf-8'})
+        self.assertEqual(parsed, JSONParser().parse(io.BytesIO(content), 'application/json', {}))
+        self.assertEqual(parsed['expiration_date'], '2024-05-01T12:30:15.123456Z')
+
+    @unittest.skipIf(renderers.orjson is None, "orjson isn't installed")
+    def test_orjson_output_matches_drf(self):
+        self.assert_same_as_drf()
+        with self.assertRaises(ParseError):
+            parsers.FastJSONParser().parse(io.BytesIO(b'{"a": '), 'application/json', {'encoding': 'utf-8'})
+
+    @unittest.skipIf(renderers.orjson is None, "orjson isn't installed")
+    def test_orjson_writes_non_finite_floats_as_null(self):
+        self.assertEqual(renderers.FastJSONRenderer().render([float('nan')]), b'[null]')
+
+    def test_fallback_without_orjson(self):
+        with mock.patch.object(renderers, 'orjson', None), mock.patch.object(parsers, 'orjson', None):
+            self.assert_same_as_drf()
@@ -1,10 +1,28 @@
+import json
+import time
 from collections import OrderedDict
+from datetime import timedelta
+from unittest import mock
 
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
 
-from ..models import User, ReferralCode
+from .. import cache, throttling
+from ..hashers import run_hashing
+from ..metrics import RequestMetricsMiddleware, registry
+from ..models import User, ReferralCode, ReferralTreePath
+from ..routers import ReplicaRouter, is_pinned, pin_to_primary, read_from_replica
+from ..serializers import ReferralCodeSerializer
+from ..tree import link_referrals
 
 
 class UserRegisterViewTestCase(APITestCase):
@@ -24,6 +42,93 @@ class UserRegisterViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['error'], 'User with this username already exists!')
 
+    def test_register_is_a_single_insert(self):
+        url = reverse('register')
+        data = {'username': 'vladimir', 'password': 'password666', 'email': 'vladimir@gmail.com'}
+        with self.assertNumQueries(1):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_register_with_referral_code_query_count(self):
+        referrer = User.objects.create_user(username='referrer', password='password666')
+        code = ReferralCode.objects.create(user=referrer)
+        url = reverse('register')
+        data = {'username': 'vladimir', 'password': 'password666', 'referral_code': code.code}
+        # Code lookup, INSERT of the user, INSERT ... SELECT of the closure rows, the
+        # counters' UPDATE, the outbox event INSERT, plus SAVEPOINT/RELEASE around the writes.
+        with self.assertNumQueries(7):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.get(username='vladimir').referrer, referrer)
+
+
+class AsyncUserRegisterViewTestCase(APITestCase):
+    def test_register_hashes_off_the_event_loop(self):
+        referrer = User.objects.create_user(username='referrer', password='password666')
+        code = ReferralCode.objects.create(user=referrer)
+        data = {'username': 'vladimir', 'password': 'password666', 'email': 'Vladimir@Gmail.com',
+                'referral_code': code.code}
+        with mock.patch('my_referrals.async_views.run_hashing', wraps=run_hashing) as offloaded:
+            response = self.client.post(reverse('async_register'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {'username': 'vladimir'})
+        offloaded.assert_awaited_once_with(make_password, 'password666')
+
+        user = User.objects.get(username='vladimir')
+        self.assertTrue(user.check_password('password666'))
+        self.assertEqual((user.referrer, user.email_normalized), (referrer, 'vladimir@gmail.com'))
+        self.assertTrue(ReferralTreePath.objects.filter(ancestor=referrer, descendant=user).exists())
+
+    def test_register_rejections(self):
+        User.objects.create_user(username='vladimir', password='password666')
+        url = reverse('async_register')
+        response = self.client.post(url, {'username': 'vladimir', 'password': 'password666'}, format='json')
+        self.assertEqual(response.json(), {'error': 'User with this username already exists!'})
+        response = self.client.post(url, {'username': 'harry', 'password': 'password666', 'referral_code': 'nope'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('This referral code does not exist', response.json()['error'])
+
+
+class UserBatchRegisterViewTestCase(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='password666', is_staff=True)
+        self.code = ReferralCode.objects.create(user=self.admin)
+        self.client.force_authenticate(user=self.admin)
+
+    def test_register_users_in_batch(self):
+        User.objects.create_user(username='taken', password='password666')
+        data = {'users': [
+            {'username': 'first', 'password': 'password666', 'referral_code': self.code.code},
+            {'username': 'taken', 'password': 'password666'},
+            {'username': 'second', 'password': 'password666', 'referral_code': 'missing'},
+            {'username': 'third', 'password': 'password666', 'email': 'third@gmail.com'},
+            {'username': 'third', 'password': 'password666'},
+            {'password': 'password666'},
+        ]}
+        response = self.client.post(reverse('register_batch'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(['id' in result for result in response.data['results']],
+                         [True, False, False, True, False, False])
+        self.assertEqual(response.data['results'][1]['error'], 'User with this username already exists!')
+
+        first = User.objects.get(username='first')
+        self.assertEqual(first.referrer, self.admin)
+        self.assertTrue(first.check_password('password666'))
+        self.assertTrue(ReferralTreePath.objects.filter(ancestor=self.admin, descendant=first).exists())
+
+    def test_register_batch_requires_an_object(self):
+        for data in ([{'username': 'first', 'password': 'password666'}], 'first'):
+            response = self.client.post(reverse('register_batch'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['error'], 'A non-empty list of users is required!')
+
+    def test_register_batch_requires_staff(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='vladimir', password='password666'))
+        response = self.client.post(reverse('register_batch'), {'users': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class UserLoginViewTestCase(APITestCase):
     def setUp(self):
@@ -45,6 +150,37 @@ class UserLoginViewTestCase(APITestCase):
         self.assertEqual(response.data['detail'], 'Unable to log in with provided credentials!')
 
 
+class AsyncUserLoginViewTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='vladimir', password='password666')
+
+    def test_login(self):
+        url = reverse('async_login')
+        data = {'username': 'vladimir', 'password': 'password666'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access_token', response.json())
+        self.assertIn('refresh_token', response.json())
+
+    def test_login_with_invalid_credentials(self):
+        url = reverse('async_login')
+        for data in ({'username': 'vladimir', 'password': 'wrong'}, {'username': 'nobody', 'password': 'wrong'}):
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_upgrades_password_hash(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        hashers = ['my_referrals.hashers.TunableScryptPasswordHasher', 'my_referrals.hashers.TunablePBKDF2PasswordHasher']
+        with override_settings(PASSWORD_HASHERS=hashers):
+            for url in (reverse('login'), reverse('async_login')):
+                self.user.password = make_password('password666', hasher='pbkdf2_sha256')
+                self.user.save()
+                response = self.client.post(url, {'username': 'vladimir', 'password': 'password666'}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.user.refresh_from_db()
+                self.assertTrue(self.user.password.startswith('scrypt$'))
+
+
 class ReferralCodeViewTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='vladimir', password='password666')
@@ -63,6 +199,41 @@ class ReferralCodeViewTestCase(APITestCase):
         self.assertEqual(get_code_response.status_code, status.HTTP_200_OK)
         self.assertEqual(create_code_response.data.get('code'), get_code_response.data.get('code'))
 
+    def test_rotate_referral_code(self):
+        url = reverse('referral_code_use')
+        old_code = self.client.post(url).data['code']
+        code_id = ReferralCode.objects.get(user=self.user).pk
+        # The code's UPDATE and the referrer's listing version bump, in one transaction.
+        with self.assertNumQueries(4):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(response.data['code'], old_code)
+        self.assertEqual(ReferralCode.objects.get(user=self.user).pk, code_id)
+        self.assertEqual(ReferralCode.objects.get(user=self.user).code, response.data['code'])
+
+    def test_get_referral_code_conditionally(self):
+        url = reverse('referral_code_use')
+        self.client.post(url)
+        response = self.client.get(url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertNotIn('Last-Modified', response)
+
+        self.client.post(url)
+        rotated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(rotated.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(rotated['ETag'], response['ETag'])
+
+    def test_rotate_referral_code_retries_on_collision(self):
+        taken = User.objects.create_user(username='taken', password='password666')
+        ReferralCode.objects.create(user=taken, code='taken')
+        with mock.patch('my_referrals.models.generate_code', side_effect=['taken', 'fresh']):
+            response = self.client.post(reverse('referral_code_use'))
+        self.assertEqual(response.data['code'], 'fresh')
+
     def test_delete_referral_code(self):
         url = reverse('referral_code_use')
         self.client.post(url)
@@ -70,8 +241,81 @@ class ReferralCodeViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
 
+class StatelessJWTAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        cache.shared_cache().clear()
+        self.user = User.objects.create_user(username='vladimir', password='password666')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.url = reverse('referral_code_use')
+
+    def test_request_does_not_load_user(self):
+        self.client.post(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user'], self.user.id)
+
+    @override_settings(JWT_USER_ACTIVE_CACHE_TTL=0)
+    def test_active_status_check_can_be_disabled(self):
+        self.client.post(self.url)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    def test_inactive_user_is_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AsyncViewsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='vladimir', password='password666',
+                                             email='vladimir@gmail.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_requires_token(self):
+        self.client.credentials()
+        response = self.client.get(reverse('async_referral_code_use'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_referral_code_lifecycle(self):
+        url = reverse('async_referral_code_use')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        created = self.client.post(url)
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get(url).json()['code'], created.json()['code'])
+
+        email_url = reverse('async_referral_code_get_by_email', kwargs={'email': 'vladimir@gmail.com'})
+        self.assertEqual(self.client.get(email_url).json()['code'], created.json()['code'])
+
+        rotated = self.client.post(url)
+        self.assertNotEqual(rotated.json()['code'], created.json()['code'])
+        self.assertEqual(self.client.get(email_url).json()['code'], rotated.json()['code'])
+
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(email_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_referral_list(self):
+        for i in range(3):
+            User.objects.create_user(username=f'referral{i}', password='ref', referrer=self.user)
+        url = reverse('async_check_referrals_by_id', kwargs={'pk': self.user.id})
+        response = self.client.get(url, {'page_size': 2}).json()
+        usernames = [referral['username'] for referral in response['results']]
+        response = self.client.get(response['next']).json()
+        usernames += [referral['username'] for referral in response['results']]
+        self.assertIsNone(response['next'])
+        self.assertEqual(sorted(usernames), ['referral0', 'referral1', 'referral2'])
+
+        missing = reverse('async_check_referrals_by_id', kwargs={'pk': 'not-a-user'})
+        self.assertEqual(self.client.get(missing).status_code, status.HTTP_404_NOT_FOUND)
+
+
 class ReferralCodeByEmailTestCase(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='vladimir', password='password666')
         self.client.force_authenticate(user=self.user)
 
@@ -86,8 +330,158 @@ class ReferralCodeByEmailTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data.get('user'), test_referer.id)
 
+    def test_get_code_by_email_is_cached(self):
+        test_referer = User.objects.create_user(username='harrypotter', password='harrypotter',
+                                                email='harrypotter@gmail.com')
+        ReferralCode.objects.create(user=test_referer)
+        url = reverse('referral_code_get_by_email', kwargs={'email': 'harrypotter@gmail.com'})
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_code_by_email_ignores_case(self):
+        test_referer = User.objects.create_user(username='harrypotter', password='harrypotter',
+                                                email='HarryPotter@Gmail.com')
+        self.assertEqual(test_referer.email_normalized, 'harrypotter@gmail.com')
+        ReferralCode.objects.create(user=test_referer)
+        url = reverse('referral_code_get_by_email', kwargs={'email': 'harryPOTTER@gmail.com'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('user'), test_referer.id)
+
+        test_referer.email = 'harry@gmail.com'
+        test_referer.save(update_fields=['email'])
+        test_referer.refresh_from_db()
+        self.assertEqual(test_referer.email_normalized, 'harry@gmail.com')
+
+    def test_rotated_code_is_visible_immediately(self):
+        url = reverse('referral_code_get_by_email', kwargs={'email': 'vladimir@gmail.com'})
+        self.user.email = 'vladimir@gmail.com'
+        self.user.save()
+        old_code = self.client.post(reverse('referral_code_use')).data['code']
+        self.assertEqual(self.client.get(url).data['code'], old_code)
+
+        new_code = self.client.post(reverse('referral_code_use')).data['code']
+        self.assertEqual(self.client.get(url).data['code'], new_code)
+
+        self.client.delete(reverse('referral_code_use'))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_code_loaded_before_a_rotation_is_not_served(self):
+        old_code = ReferralCode.objects.create(user=self.user)
+        key = cache.make_key('email', 'vladimir@gmail.com')
+
+        def load_racing_rotation():
+            self.client.post(reverse('referral_code_use'))
+            return old_code
+        cache.read_through(key, load_racing_rotation)
+        referral_code = cache.read_through(key, lambda: None)
+        self.assertIsNone(referral_code)
+
+    def test_cache_miss_is_a_single_query(self):
+        referral_code = ReferralCode.objects.create(user=self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get_code_by_code(referral_code.code), referral_code)
+        with self.assertNumQueries(0):
+            cache.get_code_by_code(referral_code.code)
+
+        # Codes read right after an invalidation aren't cached...
+        self.client.post(reverse('referral_code_use'))
+        referral_code = ReferralCode.objects.get(user=self.user)
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(cache.get_code_by_code(referral_code.code), referral_code)
+        # ...until it can no longer have overtaken the read.
+        later = time.time() + cache.get_setting('INVALIDATION_GRACE')
+        with mock.patch('my_referrals.cache.time.time', return_value=later):
+            cache.get_code_by_code(referral_code.code)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_code_by_code(referral_code.code), referral_code)
+
+    def test_email_change_moves_lookups(self):
+        ReferralCode.objects.create(user=self.user)
+        later_user = User.objects.create_user(username='harrypotter', password='harrypotter',
+                                              email='harrypotter@gmail.com')
+        later_code = ReferralCode.objects.create(user=later_user)
+        old_url = reverse('referral_code_get_by_email', kwargs={'email': 'vladimir@gmail.com'})
+        new_url = reverse('referral_code_get_by_email', kwargs={'email': 'harrypotter@gmail.com'})
+        self.user.email = 'vladimir@gmail.com'
+        self.user.save()
+        self.assertEqual(self.client.get(old_url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(new_url).data['code'], later_code.code)
+
+        user = User.objects.get(pk=self.user.pk)
+        user.email = 'HarryPotter@gmail.com'
+        user.save()
+        self.assertEqual(self.client.get(old_url).status_code, status.HTTP_404_NOT_FOUND)
+        # The earliest user with the email wins.
+        self.assertEqual(self.client.get(new_url).data['user'], self.user.id)
+
+
+class ReferralCodeBatchLookupViewTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='vladimir', password='password666')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('referral_code_batch_lookup')
+        self.codes = {}
+        for name in ('harry', 'ron', 'hermione'):
+            user = User.objects.create_user(username=name, password='password666', email=f'{name}@gmail.com')
+            self.codes[name] = ReferralCode.objects.create(user=user)
+        self.codes['ron'].expiration_date = timezone.now() - timedelta(days=1)
+        self.codes['ron'].save()
+
+    def test_lookup_by_emails_in_two_queries(self):
+        emails = ['Harry@gmail.com', 'ron@gmail.com', 'nobody@gmail.com', 'not an email', 'hermione@gmail.com']
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {'emails': emails}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(list(results), emails)
+        self.assertEqual(results['Harry@gmail.com']['code'], self.codes['harry'].code)
+        self.assertEqual(results['hermione@gmail.com']['code'], self.codes['hermione'].code)
+        for email in ('ron@gmail.com', 'nobody@gmail.com', 'not an email'):
+            self.assertEqual(results[email], {'error': 'Referral code not found or expired!'})
+
+    def test_lookup_by_codes_in_one_query(self):
+        codes = [self.codes['harry'].code.lower(), self.codes['ron'].code]
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'codes': codes}, format='json')
+        self.assertEqual(response.data['results'][codes[0]]['user'], self.codes['harry'].user_id)
+        self.assertIn('error', response.data['results'][codes[1]])
+
+    def test_shared_email_resolves_as_in_single_lookups(self):
+        # The earliest user with a code owns the email, even when that code has expired.
+        later = User.objects.create_user(username='ron2', password='password666', email='RON@gmail.com')
+        ReferralCode.objects.create(user=later)
+        response = self.client.post(self.url, {'emails': ['ron@gmail.com']}, format='json')
+        self.assertEqual(response.data['results']['ron@gmail.com'], {'error': 'Referral code not found or expired!'})
+        single = self.client.get(reverse('referral_code_get_by_email', kwargs={'email': 'ron@gmail.com'}))
+        self.assertEqual(single.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_owners_pins_are_checked_when_reading_from_replica(self):
+        with mock.patch('my_referrals.views.read_alias', return_value='replica_0'), \
+                mock.patch('my_referrals.views.is_pinned', return_value=True) as pinned:
+            response = self.client.post(self.url, {'emails': ['harry@gmail.com', 'hermione@gmail.com']}, format='json')
+        self.assertEqual(set(pinned.call_args.args), {self.codes['harry'].user_id, self.codes['hermione'].user_id})
+        self.assertEqual(response.data['results']['harry@gmail.com']['code'], self.codes['harry'].code)
+
+        with mock.patch('my_referrals.views.read_alias', return_value='replica_0'), \
+                mock.patch('my_referrals.views.is_pinned', return_value=True) as pinned:
+            response = self.client.post(self.url, {'codes': [self.codes['harry'].code]}, format='json')
+        self.assertEqual(pinned.call_args.args, (self.codes['harry'].user_id,))
+        self.assertEqual(response.data['results'][self.codes['harry'].code]['user'], self.codes['harry'].user_id)
+
+    def test_invalid_batches_are_rejected(self):
+        for data in ([{'emails': ['a@gmail.com']}], 'a@gmail.com', {}, {'emails': []}, {'emails': ['a@gmail.com'], 'codes': ['x']}, {'codes': 'x'},
+                     {'codes': [1]}, {'codes': ['x'] * 101}):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class UserReferralListViewTestCase(APITestCase):
+    no_code = {'referral_code': None, 'referral_code_expiration_date': None}
+
     def setUp(self):
         self.user = User.objects.create_user(username='vladimir', password='password666')
         self.client.force_authenticate(user=self.user)
@@ -97,8 +491,350 @@ class UserReferralListViewTestCase(APITestCase):
         referral_two = User.objects.create_user(username='referral2', password='ref2', referrer=self.user)
         url = reverse('check_referrals_by_id', kwargs={'pk': self.user.id})
         response = self.client.get(url)
-        response_data_sorted = sorted(response.data, key=lambda x: x['username'])
-        expected_data_sorted = sorted([{'username': 'referral1'}, {'username': 'referral2'}], key=lambda x: x['username'])
+        response_data_sorted = sorted(response.data['results'], key=lambda x: x['username'])
+        expected_data_sorted = sorted([{'username': 'referral1', **self.no_code}, {'username': 'referral2', **self.no_code}],
+                                      key=lambda x: x['username'])
         self.assertEqual(response_data_sorted, expected_data_sorted)
 
+    def test_get_user_referrals_paginated(self):
+        for i in range(5):
+            User.objects.create_user(username=f'referral{i}', password='ref', referrer=self.user)
+        url = reverse('check_referrals_by_id', kwargs={'pk': self.user.id})
+        usernames = []
+        response = self.client.get(url, {'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            usernames += [referral['username'] for referral in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sorted(usernames), [f'referral{i}' for i in range(5)])
+
+    def test_get_user_referrals_reads_only_listed_columns(self):
+        User.objects.create_user(username='referral1', password='ref1', referrer=self.user)
+        url = reverse('check_referrals_by_id', kwargs={'pk': self.user.id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.data['results'], [{'username': 'referral1', **self.no_code}])
+        self.assertNotIn('password', queries[-1]['sql'])
+
+    def test_get_user_referrals_invalid_cursor(self):
+        url = reverse('check_referrals_by_id', kwargs={'pk': self.user.id})
+        response = self.client.get(url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stream_user_referrals(self):
+        User.objects.create_user(username='referral1', password='ref1', referrer=self.user)
+        User.objects.create_user(username='referral2', password='ref2', referrer=self.user)
+        url = reverse('check_referrals_by_id', kwargs={'pk': self.user.id})
+        response = self.client.get(url, {'stream': 1})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'username': 'referral1', **self.no_code}, {'username': 'referral2', **self.no_code}])
+        for value in ('0', 'false'):
+            self.assertEqual(self.client.get(url, {'stream': value})['Content-Type'], 'application/json')
+
+    def test_get_user_referrals_with_active_codes_in_constant_queries(self):
+        url = reverse('check_referrals_by_id', kwargs={'pk': self.user.id})
+        for size in (4, 20):
+            User.objects.filter(referrer=self.user).delete()
+            for i in range(size):
+                referral = User.objects.create_user(username=f'referral{i}', password='ref', referrer=self.user)
+                if i % 2:
+                    expiration_date = timezone.now() + timedelta(days=1 if i % 4 == 1 else -1)
+                    ReferralCode.objects.create(user=referral, expiration_date=expiration_date)
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {'page_size': 100})
+
+            results = {referral['username']: referral for referral in response.data['results']}
+            self.assertEqual(len(results), size)
+            active = ReferralCode.objects.get(user__username='referral1')
+            self.assertEqual(results['referral1']['referral_code'], active.code)
+            self.assertEqual(results['referral1']['referral_code_expiration_date'],
+                             ReferralCodeSerializer(active).data['expiration_date'])
+            # Referral 3's code has expired, referral 0 has none.
+            self.assertEqual({key: results['referral3'][key] for key in self.no_code}, self.no_code)
+            self.assertEqual({key: results['referral0'][key] for key in self.no_code}, self.no_code)
+
+    def test_get_user_referrals_conditionally(self):
+        referral = User.objects.create_user(username='referral1', password='ref1', referrer=self.user)
+        link_referrals([referral])
+        ReferralCode.objects.create(user=referral, expiration_date=timezone.now() + timedelta(days=1))
+        url = reverse('check_referrals_by_id', kwargs={'pk': self.user.id})
+        response = self.client.get(url)
+
+        def get_conditionally():
+            return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        # Only the referrer is read.
+        with self.assertNumQueries(1):
+            self.assertEqual(get_conditionally().status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         status.HTTP_200_OK)
+
+        # The page changes when the referral's code expires...
+        expired = time.time() + timedelta(days=2).total_seconds()
+        with mock.patch('my_referrals.conditional.time.time', return_value=expired):
+            self.assertEqual(get_conditionally().status_code, status.HTTP_200_OK)
+
+        # ...is rotated...
+        self.client.force_authenticate(user=referral)
+        self.client.post(reverse('referral_code_use'))
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(get_conditionally().status_code, status.HTTP_200_OK)
+
+        # ...or when a referral joins, even if a stale instance of the referrer is saved afterwards.
+        response = self.client.get(url)
+        stale = User.objects.get(pk=self.user.pk)
+        link_referrals([User.objects.create_user(username='referral2', password='ref2', referrer=self.user)])
+        stale.first_name = 'Vladimir'
+        stale.save()
+        self.assertEqual(get_conditionally().status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.get(pk=self.user.pk).direct_referrals_count, 2)
+
+    def test_referrals_version_changes_with_the_listing_only(self):
+        referral = User.objects.create_user(username='referral1', password='ref1', referrer=self.user)
+        link_referrals([referral])
+
+        def version():
+            return User.objects.get(pk=self.user.pk).referrals_version
+        referral = User.objects.get(pk=referral.pk)
+        before = version()
+        referral.set_password('another password')
+        referral.last_login = timezone.now()
+        referral.save()
+        self.assertEqual(version(), before)
+        referral.username = 'renamed'
+        referral.save()
+        self.assertEqual(version(), before + 1)
+
+        for url in (reverse('referral_code_use'), reverse('async_referral_code_use')):
+            self.client.force_authenticate(user=referral)
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(referral)}')
+            before = version()
+            self.client.post(url)
+            self.assertEqual(version(), before + 1)
+            self.client.delete(url)
+            self.assertEqual(version(), before + 2)
+
+
+class ReplicaRoutingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='vladimir', password='password666')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'])
+    def test_reads_go_to_replica_unless_pinned(self):
+        router = ReplicaRouter()
+        other = User.objects.create_user(username='other', password='password666')
+        with read_from_replica(self.user.id) as alias:
+            self.assertEqual(alias, 'replica_0')
+            self.assertEqual(router.db_for_read(User), 'replica_0')
+            self.assertEqual(router.db_for_write(User), 'default')
+        self.assertIsNone(router.db_for_read(User))
+
+        pin_to_primary(self.user.id)
+        with read_from_replica(self.user.id):
+            self.assertIsNone(router.db_for_read(User))
+        with read_from_replica(other.id):
+            self.assertEqual(router.db_for_read(User), 'replica_0')
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_writes_pin_users_to_primary(self):
+        response = self.client.post(reverse('referral_code_use'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(is_pinned(self.user.id))
+
+        cache.clear()
+        data = {'username': 'referral', 'password': 'password666', 'referral_code': response.data['code']}
+        response = self.client.post(reverse('register'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(is_pinned(self.user.id))
+        self.assertTrue(is_pinned(User.objects.get(username='referral').id))
+
+        response = self.client.get(reverse('referral_code_use'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_no_replicas_reads_from_primary(self):
+        pin_to_primary(self.user.id)
+        self.assertFalse(is_pinned(self.user.id))
+        with read_from_replica(self.user.id) as alias:
+            self.assertIsNone(alias)
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], **rates},
+    })
+
+
+class ThrottlingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        throttling.blocked.clear()
+        # Buckets drained at test rates would otherwise throttle later tests.
+        self.addCleanup(cache.clear)
+        self.addCleanup(throttling.blocked.clear)
+        self.user = User.objects.create_user(username='vladimir', password='password666',
+                                             email='vladimir@gmail.com')
+
+    @throttle_rates(login='2/min')
+    def test_login_is_throttled_per_ip(self):
+        data = {'username': 'vladimir', 'password': 'wrong'}
+        for _ in range(2):
+            response = self.client.post(reverse('login'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('login'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+
+        # Retries are rejected in-process, without reading the shared bucket.
+        with mock.patch.object(throttling.TokenBucketThrottle, 'cache') as shared_cache:
+            response = self.client.post(reverse('async_login'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        shared_cache.get.assert_not_called()
+
+        response = self.client.post(reverse('login'), data, format='json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @throttle_rates(email_lookup='1/min')
+    def test_email_lookup_is_throttled_per_user(self):
+        url = reverse('referral_code_get_by_email', kwargs={'email': 'vladimir@gmail.com'})
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(url, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_bucket_refills_over_time(self):
+        view = mock.Mock(throttle_scope='login')
+        request = mock.Mock(META={'REMOTE_ADDR': '10.0.0.3'})
+        with throttle_rates(login='2/min'), mock.patch.object(throttling.TokenBucketThrottle, 'timer') as timer:
+            timer.return_value = 1000.0
+            self.assertTrue(throttling.IPTokenBucketThrottle().allow_request(request, view))
+            self.assertTrue(throttling.IPTokenBucketThrottle().allow_request(request, view))
+            self.assertFalse(throttling.IPTokenBucketThrottle().allow_request(request, view))
+
+            throttling.blocked.clear()
+            timer.return_value = 1030.0
+            self.assertTrue(throttling.IPTokenBucketThrottle().allow_request(request, view))
+            self.assertFalse(throttling.IPTokenBucketThrottle().allow_request(request, view))
+
+
+class UserReferralTreeViewTestCase(APITestCase):
+    def register(self, username, referrer):
+        code, _ = ReferralCode.objects.get_or_create(user=referrer)
+        data = {'username': username, 'password': 'password666', 'referral_code': code.code}
+        self.client.post(reverse('register'), data, format='json')
+        return User.objects.get(username=username)
+
+    def setUp(self):
+        self.root = User.objects.create_user(username='vladimir', password='password666')
+        self.child = self.register('child', self.root)
+        self.grandchild = self.register('grandchild', self.child)
+        self.client.force_authenticate(user=self.root)
+
+    def test_get_referral_tree(self):
+        url = reverse('referral_tree_by_id', kwargs={'pk': self.root.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['depth_counts'], {1: 1, 2: 1})
+        self.assertEqual([(node['username'], node['depth']) for node in response.data['descendants']],
+                         [('child', 1), ('grandchild', 2)])
+
+    def test_get_referral_tree_ancestors_and_depth(self):
+        url = reverse('referral_tree_by_id', kwargs={'pk': self.grandchild.id})
+        response = self.client.get(url)
+        self.assertEqual([(node['username'], node['depth']) for node in response.data['ancestors']],
+                         [('child', 1), ('vladimir', 2)])
+
+        url = reverse('referral_tree_by_id', kwargs={'pk': self.root.id})
+        response = self.client.get(url, {'depth': 1})
+        self.assertEqual(response.data['depth_counts'], {1: 1})
+
+    def test_get_referral_tree_of_malformed_pk(self):
+        response = self.client.get(reverse('referral_tree_by_id', kwargs={'pk': 'not-a-uuid'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deleted_referrer_detaches_subtree(self):
+        self.child.delete()
+        self.assertFalse(ReferralTreePath.objects.filter(ancestor=self.root).exists())
+        self.assertFalse(ReferralTreePath.objects.filter(descendant=self.grandchild).exists())
+        self.root.refresh_from_db()
+        self.assertEqual((self.root.direct_referrals_count, self.root.total_referrals_count), (0, 0))
+
+    def test_referral_counters(self):
+        self.root.refresh_from_db()
+        self.child.refresh_from_db()
+        self.assertEqual((self.root.direct_referrals_count, self.root.total_referrals_count), (1, 2))
+        self.assertEqual((self.child.direct_referrals_count, self.child.total_referrals_count), (1, 1))
+
+    def test_leaderboard(self):
+        self.register('second_child', self.root)
+        response = self.client.get(reverse('referral_leaderboard'), {'by': 'direct'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(user['username'], user['direct_referrals_count']) for user in response.data],
+                         [('vladimir', 2), ('child', 1)])
+
+        response = self.client.get(reverse('referral_leaderboard'), {'limit': 1})
+        self.assertEqual([(user['username'], user['total_referrals_count']) for user in response.data],
+                         [('vladimir', 3)])
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_SERVER_TIMING=True)
+class RequestMetricsTestCase(APITestCase):
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create_user(username='vladimir', password='password666')
+        self.client.force_authenticate(user=self.user)
+
+    def test_request_metrics(self):
+        self.client.post(reverse('referral_code_use'))
+        response = self.client.get(reverse('referral_code_use'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+        self.user.is_staff = True
+        self.user.save(update_fields=['is_staff'])
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('http_requests_total{route="api/ref_code/",method="GET",status="200"} 1', metrics)
+        self.assertIn('http_request_db_queries_count{route="api/ref_code/",method="GET"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{route="api/ref_code/",method="GET",le="+Inf"} 1',
+                      metrics)
+
+    @override_settings(METRICS_TOKEN='scraper-secret')
+    def test_metrics_require_staff_or_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer scraper-secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('http_requests_total', response.content.decode())
+
+    async def test_async_request_metrics(self):
+        token = AccessToken.for_user(self.user)
+        response = await self.async_client.post(reverse('async_referral_code_use'),
+                                                headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+        self.assertIn('http_requests_total{route="api/async/ref_code/",method="POST",status="201"} 1',
+                      registry.render())
+
+    def test_middleware_runs_async_in_async_chains(self):
+        async def get_response(request):
+            pass
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(RequestMetricsMiddleware(lambda request: None)))
 
+    @override_settings(METRICS_ENABLED=False)
+    def test_metrics_disabled(self):
+        response = self.client.get(reverse('referral_code_use'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
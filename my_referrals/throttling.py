@@ -0,0 +1,107 @@
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .cache import LocalTTLCache
+from .constants import THROTTLE_LOCAL_MAX_SIZE
+
+# Clients the shared buckets have turned away, until their next token is due
+blocked = LocalTTLCache(THROTTLE_LOCAL_MAX_SIZE)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle for views setting throttle_scope. A rate of "N/period"
+    from DEFAULT_THROTTLE_RATES allows bursts of N requests, refilled at N per
+    period. Buckets live in the default cache, shared by all workers; a client
+    that runs out is also remembered in-process until its next token is due,
+    so its retries are rejected without a cache round trip. Reading and writing
+    a bucket isn't atomic, so concurrent requests may rarely get an extra token.
+    """
+    def __init__(self):
+        # The scope, and with it the rate, comes from the view in allow_request().
+        pass
+
+    def get_rate(self):
+        # Read on every request rather than once at import, so the rates follow settings changes.
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{self.scope}' scope")
+
+    def get_bucket_key(self, request, view):
+        self.scope = getattr(view, 'throttle_scope', None)
+        if not self.scope:
+            return None
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.rate is None:
+            return None
+        return self.get_cache_key(request, view)
+
+    def take_token(self, bucket):
+        """
+        Returns the bucket left after this request, or None if it is empty.
+        """
+        tokens, updated_at = bucket or (self.num_requests, self.now)
+        tokens = min(self.num_requests, tokens + (self.now - updated_at) * self.num_requests / self.duration)
+        if tokens < 1:
+            self.retry_at = self.now + (1 - tokens) * self.duration / self.num_requests
+            blocked.set(self.key, self.retry_at, self.retry_at - self.now)
+            return None
+        return tokens - 1, self.now
+
+    def allow_request(self, request, view):
+        self.key = self.get_bucket_key(request, view)
+        if self.key is None:
+            return True
+        self.now = self.timer()
+        self.retry_at = blocked.get(self.key)
+        if self.retry_at is not None:
+            return False
+
+        bucket = self.take_token(self.cache.get(self.key))
+        if bucket is None:
+            return False
+        # An untouched bucket is full again after one period, so it can expire then.
+        self.cache.set(self.key, bucket, self.duration)
+        return True
+
+    async def aallow_request(self, request, view):
+        """
+        Async counterpart of allow_request(), for views outside DRF.
+        """
+        self.key = self.get_bucket_key(request, view)
+        if self.key is None:
+            return True
+        self.now = self.timer()
+        self.retry_at = blocked.get(self.key)
+        if self.retry_at is not None:
+            return False
+
+        bucket = self.take_token(await self.cache.aget(self.key))
+        if bucket is None:
+            return False
+        await self.cache.aset(self.key, bucket, self.duration)
+        return True
+
+    def wait(self):
+        return max(self.retry_at - self.timer(), 0)
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles requests by client IP.
+    """
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': f"ip:{self.get_ident(request)}"}
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles authenticated requests by user.
+    """
+    def get_cache_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': f"user:{request.user.pk}"}
@@ -0,0 +1,73 @@
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import ReferralTreePath, User
+
+# Number of ids per IN (...) clause when detaching a large subtree
+DETACH_CHUNK_SIZE = 1000
+
+
+def link_referrals(users):
+    """
+    Adds closure rows for freshly inserted users (one row to the referrer and
+    one to each of the referrer's ancestors) and bumps the referral counters
+    along the way. Both are set-based statements over the whole batch of
+    users, so registration costs two queries whether it is one user or many.
+    """
+    user_ids = [user.pk for user in users if user.referrer_id]
+    if not user_ids:
+        return
+
+    # INSERT ... SELECT copies the referrer's paths without reading them back.
+    qn = connection.ops.quote_name
+    paths, users_table = qn(ReferralTreePath._meta.db_table), qn(User._meta.db_table)
+    ancestor, descendant, depth = (qn(ReferralTreePath._meta.get_field(name).column)
+                                   for name in ('ancestor', 'descendant', 'depth'))
+    user_id, referrer_id = qn(User._meta.pk.column), qn(User._meta.get_field('referrer').column)
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {paths} ({ancestor}, {descendant}, {depth}) "
+            f"SELECT u.{referrer_id}, u.{user_id}, 1 FROM {users_table} u WHERE u.{user_id} IN ({placeholders}) "
+            f"UNION ALL "
+            f"SELECT p.{ancestor}, u.{user_id}, p.{depth} + 1 FROM {users_table} u "
+            f"INNER JOIN {paths} p ON p.{descendant} = u.{referrer_id} WHERE u.{user_id} IN ({placeholders})",
+            [User._meta.pk.get_db_prep_value(pk, connection) for pk in user_ids] * 2,
+        )
+
+    new_paths = ReferralTreePath.objects.filter(descendant_id__in=user_ids)
+
+    def count_new_paths(**filters):
+        counts = new_paths.filter(ancestor_id=OuterRef('pk'), **filters).values('ancestor_id').annotate(
+            count=Count('*')).values('count')
+        return Coalesce(Subquery(counts), Value(0))
+    User.objects.filter(pk__in=new_paths.values('ancestor_id')).update(
+        direct_referrals_count=F('direct_referrals_count') + count_new_paths(depth=1),
+        total_referrals_count=F('total_referrals_count') + count_new_paths(),
+        referrals_version=F('referrals_version') + count_new_paths(depth=1),
+    )
+
+
+def detach_subtree(user):
+    """
+    Removes the paths that run through a user who is about to be deleted.
+    Rows that have the user as an end are cascaded by the database, but the
+    user's referrals become roots (referrer is SET_NULL), so the paths from
+    the user's ancestors to the user's descendants have to go as well, and
+    the ancestors lose the user's whole subtree from their counters.
+    """
+    ancestor_ids = list(ReferralTreePath.objects.filter(descendant=user).values_list('ancestor_id', flat=True))
+    if not ancestor_ids:
+        return
+    descendant_ids = list(ReferralTreePath.objects.filter(ancestor=user).values_list('descendant_id', flat=True))
+    for start in range(0, len(descendant_ids), DETACH_CHUNK_SIZE):
+        ReferralTreePath.objects.filter(
+            ancestor_id__in=ancestor_ids,
+            descendant_id__in=descendant_ids[start:start + DETACH_CHUNK_SIZE],
+        ).delete()
+
+    User.objects.filter(pk=user.referrer_id).update(
+        direct_referrals_count=F('direct_referrals_count') - 1, referrals_version=F('referrals_version') + 1)
+    User.objects.filter(pk__in=ancestor_ids).update(
+        total_referrals_count=F('total_referrals_count') - (len(descendant_ids) + 1))
@@ -5,6 +5,8 @@ from rest_framework_simplejwt.views import (
     TokenVerifyView
 )
 
+from .async_views import *
+from .metrics import metrics_view
 from .views import *
 
 urlpatterns = [
@@ -12,9 +14,19 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
     path('api/register/', UserRegisterView.as_view(), name="register"),
+    path('api/register/batch/', UserBatchRegisterView.as_view(), name="register_batch"),
+    path('api/async/register/', AsyncUserRegisterView.as_view(), name="async_register"),
     path('api/login/', UserLoginView.as_view(), name="login"),
+    path('api/async/login/', AsyncUserLoginView.as_view(), name="async_login"),
     path('api/ref_code/', ReferralCodeView.as_view(), name="referral_code_use"),
     path('api/ref_code_by_email/<str:email>/', ReferralCodeByEmailView.as_view(), name="referral_code_get_by_email"),
+    path('api/ref_code/batch/', ReferralCodeBatchLookupView.as_view(), name="referral_code_batch_lookup"),
     path('api/referrals-list/<str:pk>/', UserReferralListView.as_view(), name="check_referrals_by_id"),
+    path('api/async/ref_code/', AsyncReferralCodeView.as_view(), name="async_referral_code_use"),
+    path('api/async/ref_code_by_email/<str:email>/', AsyncReferralCodeByEmailView.as_view(),
+         name="async_referral_code_get_by_email"),
+    path('api/async/referrals-list/<str:pk>/', AsyncUserReferralListView.as_view(), name="async_check_referrals_by_id"),
+    path('api/referrals-tree/<str:pk>/', UserReferralTreeView.as_view(), name="referral_tree_by_id"),
+    path('api/leaderboard/', ReferralLeaderboardView.as_view(), name="referral_leaderboard"),
+    path('metrics/', metrics_view, name="metrics"),
 ]
-
@@ -1,14 +1,64 @@
+import secrets
 import uuid
 from datetime import timedelta
+from django.conf import settings
 from django.utils import timezone
 
 
-from .constants import REFERRAL_CODE_EXPIRATION_IN_DAYS
+from .constants import REFERRAL_CODE_EXPIRATION_IN_DAYS, REFERRAL_CODE_LENGTH
+
+# Crockford's base32 alphabet: no I, L, O or U, so codes are easy to read aloud and type
+CODE_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_ALIASES = str.maketrans({'O': '0', 'I': '1', 'L': '1'})
+HEX_DIGITS = set('0123456789abcdef')
 
 
 def get_code_expiration_time():
     return timezone.now() + timedelta(days=REFERRAL_CODE_EXPIRATION_IN_DAYS)
 
 
+def code_checksum(body):
+    """
+    Luhn mod 32 check character: catches every single mistyped character and
+    most swaps of two adjacent ones.
+    """
+    total = 0
+    for position, char in enumerate(reversed(body)):
+        value = CODE_ALPHABET.index(char) * (2 if position % 2 == 0 else 1)
+        total += value // 32 + value % 32
+    return CODE_ALPHABET[-total % 32]
+
+
 def generate_code():
-    return str(uuid.uuid4().hex)
\ No newline at end of file
+    if getattr(settings, 'REFERRAL_CODE_FORMAT', 'base32') == 'hex':
+        return str(uuid.uuid4().hex)
+    body = ''.join(secrets.choice(CODE_ALPHABET) for _ in range(REFERRAL_CODE_LENGTH))
+    return body + code_checksum(body)
+
+
+def normalize_code(code):
+    """
+    Returns the code as stored in the database, or None when it cannot be a
+    valid code, so that typos are rejected without a query. Accepts base32
+    codes in any case, with dashes or spaces, and with O/I/L typed for 0/1/1,
+    as well as the 32-character hex codes of the "hex" format.
+    """
+    code = code.strip()
+    if len(code) == 32 and set(code.lower()) <= HEX_DIGITS:
+        return code.lower()
+
+    code = code.upper().replace('-', '').replace(' ', '').translate(CODE_ALIASES)
+    if len(code) != REFERRAL_CODE_LENGTH + 1 or not set(code) <= set(CODE_ALPHABET):
+        return None
+    if code_checksum(code[:-1]) != code[-1]:
+        return None
+    return code
+
+
+def normalize_email_address(email):
+    """
+    Form of the email used for lookups: trimmed and lowercased, or None when
+    there is no email. The migration backfilling User.email_normalized does
+    the same in SQL.
+    """
+    return (email or '').strip().lower() or None
@@ -1,16 +1,41 @@
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import update_last_login
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.validators import validate_email
+from django.db import DEFAULT_DB_ALIAS, IntegrityError
+from django.db.models import Count, F
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.exceptions import NotFound, ValidationError, AuthenticationFailed
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
 
-from .serializers import UserSerializer, ReferralCodeSerializer
+from .cache import get_code_by_email, invalidate_user_codes
+from .conditional import (
+    add_validators, code_etag, not_modified, page_expires_at, referrals_etag, referrals_not_modified,
+)
+from .constants import (
+    LEADERBOARD_DEFAULT_SIZE,
+    LEADERBOARD_MAX_SIZE,
+    REFERRAL_CODE_BATCH_LOOKUP_MAX_SIZE,
+    REFERRALS_STREAM_CHUNK_SIZE,
+    REFERRAL_TREE_DEFAULT_DEPTH,
+    REFERRAL_TREE_MAX_DEPTH,
+    REFERRAL_TREE_MAX_NODES,
+    REGISTRATION_BATCH_MAX_SIZE,
+)
+from .hashers import get_executor
+from .pagination import ReferralCursorPagination, iterate_in_chunks
+from .registration import register_users
+from .renderers import dumps
+from .routers import is_pinned, pin_to_primary, read_alias, read_from_replica
+from .serializers import ReferralCodeSerializer, ReferralListSerializer, UserSerializer
+from .throttling import IPTokenBucketThrottle, UserTokenBucketThrottle
+from .utils import normalize_code, normalize_email_address
 from .models import *
 
 
@@ -19,28 +44,53 @@ class UserRegisterView(APIView):
     Takes new user's username, password and (optionally) email and referral code
     and creates a new user object.
     """
-    def post(self, request):
-        data = request.data
-
-        username = data.get('username')
-
-        if User.objects.filter(username=username).exists():
-            return Response({"error": "User with this username already exists!"},
-                            status=status.HTTP_400_BAD_REQUEST)
+    throttle_classes = [IPTokenBucketThrottle]
+    throttle_scope = 'register'
 
-        serializer = UserSerializer(data=data)
+    def post(self, request):
+        serializer = UserSerializer(data=request.data)
         try:
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            user = serializer.save()
+            pin_to_primary(user.id, user.referrer_id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except IntegrityError:
+            return Response({"error": "User with this username already exists!"},
+                            status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class UserBatchRegisterView(APIView):
+    """
+    Requires JWT access token of a staff user.
+    Takes {"users": [...]}, a list of users in the same format as the register endpoint,
+    and creates them in bulk. Returns a result for every user, in order: its id if it
+    was created, or an error if it was rejected (other users are still created).
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        users = request.data.get('users') if isinstance(request.data, dict) else None
+        if not isinstance(users, list) or not users:
+            return Response({"error": "A non-empty list of users is required!"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(users) > REGISTRATION_BATCH_MAX_SIZE:
+            return Response({"error": f"At most {REGISTRATION_BATCH_MAX_SIZE} users can be registered at once!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Spread over the hashing pool, which under ASGI is also where async registration hashes.
+        results = register_users(users, executor=get_executor())
+        created = sum('id' in result for result in results)
+        return Response({"created": created, "results": results}, status=status.HTTP_200_OK)
+
+
 class UserLoginView(APIView):
     """
     Takes user's username and password and returns JWT access token and refresh token.
     """
+    throttle_classes = [IPTokenBucketThrottle]
+    throttle_scope = 'login'
+
     def post(self, request, *args, **kwargs):
         username = request.data.get('username')
         password = request.data.get('password')
@@ -61,8 +111,8 @@ class UserLoginView(APIView):
 class ReferralCodeView(APIView):
     """
     Requires user's JWT access token.
-    GET request: returns user's referral code.
-    POST request: creates a new referral code (deletes old one if it existed).
+    GET request: returns user's referral code, with an ETag for conditional requests.
+    POST request: creates a new referral code (replaces old one if it existed).
     DELETE request: deletes user's referral code.
     """
     permission_classes = [IsAuthenticated]
@@ -74,18 +124,19 @@ class ReferralCodeView(APIView):
             raise NotFound("Referral code not found")
 
     def get(self, request):
-        code = self.get_code_object(request)
-        serializer = ReferralCodeSerializer(code)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        with read_from_replica(request.user.id):
+            code = self.get_code_object(request)
+        etag = code_etag(request, code)
+        response = not_modified(request, etag)
+        if response is None:
+            serializer = ReferralCodeSerializer(code)
+            response = Response(serializer.data, status=status.HTTP_200_OK)
+        return add_validators(response, etag)
 
     def create_or_update_code(self, request):
-        try:
-            code = self.get_code_object(request)
-            if code:
-                code.delete()
-        except NotFound:
-            pass
-        new_code = ReferralCode.objects.create(user=request.user)
+        new_code = ReferralCode.objects.rotate(request.user.id)
+        pin_to_primary(request.user.id)
+        invalidate_user_codes(request.user.id)
         return new_code
 
     def post(self, request):
@@ -94,8 +145,10 @@ class ReferralCodeView(APIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request):
-        code = self.get_code_object(request)
-        code.delete()
+        if not ReferralCode.objects.discard(request.user.id):
+            raise NotFound("Referral code not found")
+        pin_to_primary(request.user.id)
+        invalidate_user_codes(request.user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -106,12 +159,11 @@ class ReferralCodeByEmailView(APIView):
     (if the user has it).
     """
     permission_classes = [IsAuthenticated]
+    throttle_classes = [UserTokenBucketThrottle, IPTokenBucketThrottle]
+    throttle_scope = 'email_lookup'
 
     def get_object(self, email):
-        try:
-            return ReferralCode.objects.get(user__email=email)
-        except ReferralCode.DoesNotExist:
-            return None
+        return get_code_by_email(email)
 
     def get(self, request, email):
         if not email:
@@ -121,7 +173,8 @@ class ReferralCodeByEmailView(APIView):
         except ValidationError:
             return Response({"error": "Invalid email address!"}, status=status.HTTP_400_BAD_REQUEST)
 
-        referral_code = self.get_object(email)
+        with read_from_replica(request.user.id):
+            referral_code = self.get_object(email)
         if not referral_code:
             return Response({"error": "Referral code not found for the given email!"}, status=status.HTTP_404_NOT_FOUND)
         if referral_code.expiration_date < timezone.now():
@@ -131,12 +184,92 @@ class ReferralCodeByEmailView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class ReferralCodeBatchLookupView(APIView):
+    """
+    Requires user's JWT access token.
+    POST request: takes {"emails": [...]} or {"codes": [...]} and returns the valid referral
+    code of every email or code, keyed by the email or code as it was sent, or an error
+    for the ones without a valid code.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [UserTokenBucketThrottle, IPTokenBucketThrottle]
+    throttle_scope = 'batch_lookup'
+    not_found_error = "Referral code not found or expired!"
+
+    def results(self, normalized, found):
+        return {
+            item: ReferralCodeSerializer(found[value]).data if value in found else {"error": self.not_found_error}
+            for item, value in normalized.items()
+        }
+
+    def resolve_codes(self, codes):
+        """
+        Resolves all codes with a single IN query over their normalized forms
+        (codes are unique), made again on the primary if an owner of one of
+        them has just changed their code.
+        """
+        normalized = {code: normalize_code(code) for code in codes}
+        referral_codes = ReferralCode.objects.filter(
+            code__in=set(filter(None, normalized.values())), expiration_date__gte=timezone.now())
+        found = {referral_code.code: referral_code for referral_code in referral_codes}
+        if read_alias() != DEFAULT_DB_ALIAS and is_pinned(*(code.user_id for code in found.values())):
+            found = {referral_code.code: referral_code for referral_code in referral_codes.using(DEFAULT_DB_ALIAS)}
+        return self.results(normalized, found)
+
+    def resolve_emails(self, emails):
+        """
+        Resolves all emails with two IN queries over their normalized forms: one
+        for the users owning them, picked as in single lookups, and one for the
+        owners' valid codes, from the primary if any owner has just changed
+        their code.
+        """
+        normalized = {email: normalize_email_address(email) for email in emails}
+        values = set(filter(None, normalized.values()))
+        # Ordered newest first, so when users share an email the earliest one wins, as in single lookups.
+        owners = dict(
+            ReferralCode.objects.filter(user__email_normalized__in=values)
+            .order_by('-user__date_joined').values_list('user__email_normalized', 'user_id')
+        )
+        referral_codes = ReferralCode.objects.filter(
+            user_id__in=set(owners.values()), expiration_date__gte=timezone.now(),
+        ).annotate(email=F('user__email_normalized'))
+        if read_alias() != DEFAULT_DB_ALIAS and is_pinned(*owners.values()):
+            referral_codes = referral_codes.using(DEFAULT_DB_ALIAS)
+        # An owner's email may have changed since the first query.
+        found = {
+            referral_code.email: referral_code for referral_code in referral_codes
+            if owners.get(referral_code.email) == referral_code.user_id
+        }
+        return self.results(normalized, found)
+
+    def post(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+        emails, codes = data.get('emails'), data.get('codes')
+        items = emails if emails is not None else codes
+        if (emails is None) == (codes is None) or not isinstance(items, list) or not items:
+            return Response({"error": "A non-empty list of either emails or codes is required!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > REFERRAL_CODE_BATCH_LOOKUP_MAX_SIZE:
+            return Response({"error": f"At most {REFERRAL_CODE_BATCH_LOOKUP_MAX_SIZE} items can be looked up at once!"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(item, str) for item in items):
+            return Response({"error": "Every item must be a string!"}, status=status.HTTP_400_BAD_REQUEST)
+
+        with read_from_replica(request.user.id):
+            results = self.resolve_emails(emails) if emails is not None else self.resolve_codes(codes)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class UserReferralListView(APIView):
     """
     Requires user's JWT access token.
-    GET request: takes pk from the url and returns a list of referrals of corresponding user.
+    GET request: takes pk from the url and returns a page of referrals of corresponding user,
+    ordered by registration date. Pass the "next" link to get the following page.
+    Pages carry an ETag; send it back in If-None-Match to get 304 Not Modified while the page is unchanged.
+    With ?stream=1 the whole list is returned as NDJSON (one referral per line).
     """
     permission_classes = [IsAuthenticated]
+    pagination_class = ReferralCursorPagination
 
     def get_object(self, pk):
         try:
@@ -144,8 +277,99 @@ class UserReferralListView(APIView):
         except User.DoesNotExist:
             raise NotFound("User not found.")
 
+    def stream(self, referrals):
+        serializer = ReferralListSerializer()
+        lines = (
+            dumps(serializer.to_representation(referral)) + b'\n'
+            for referral in iterate_in_chunks(referrals, REFERRALS_STREAM_CHUNK_SIZE)
+        )
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
     def get(self, request, pk, format=None):
-        referrer = self.get_object(pk)
-        referrals = User.objects.filter(referrer=referrer)
-        serializer = UserSerializer(referrals, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        with read_from_replica(request.user.id, pk):
+            referrer = self.get_object(pk)
+            referrals = ReferralListSerializer.project(User.objects.filter(referrer=referrer))
+            if request.query_params.get('stream', '').lower() in ('1', 'true'):
+                # The stream is read after the view returns, so bind it to the replica now.
+                return self.stream(referrals.using(read_alias()))
+
+            response = referrals_not_modified(request, referrer)
+            if response is not None:
+                return response
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(referrals, request, view=self)
+        serializer = ReferralListSerializer(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        return add_validators(response, referrals_etag(request, referrer, page_expires_at(page)))
+
+
+class UserReferralTreeView(APIView):
+    """
+    Requires user's JWT access token.
+    GET request: takes pk from the url and returns the user's chain of referrers,
+    the number of descendants on each level of the referral tree and the descendants
+    themselves (up to ?depth=N levels deep, nearest levels first).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self, pk):
+        try:
+            return User.objects.get(pk=pk)
+        except (User.DoesNotExist, DjangoValidationError):
+            raise NotFound("User not found.")
+
+    def get_depth(self, request):
+        try:
+            depth = int(request.query_params.get('depth', REFERRAL_TREE_DEFAULT_DEPTH))
+        except ValueError:
+            raise ValidationError({"depth": "Depth must be an integer."})
+        return min(max(depth, 1), REFERRAL_TREE_MAX_DEPTH)
+
+    def get(self, request, pk, format=None):
+        user = self.get_object(pk)
+        depth = self.get_depth(request)
+
+        ancestors = ReferralTreePath.objects.filter(descendant=user).order_by('depth').values(
+            'depth', user=F('ancestor_id'), username=F('ancestor__username'))
+        subtree = ReferralTreePath.objects.filter(ancestor=user, depth__lte=depth)
+        depth_counts = subtree.values('depth').annotate(count=Count('id')).order_by('depth')
+        descendants = subtree.order_by('depth', 'descendant_id').values(
+            'depth',
+            user=F('descendant_id'),
+            username=F('descendant__username'),
+            referrer=F('descendant__referrer_id'),
+        )[:REFERRAL_TREE_MAX_NODES]
+
+        return Response({
+            "ancestors": list(ancestors),
+            "depth_counts": {row['depth']: row['count'] for row in depth_counts},
+            "descendants": list(descendants),
+        }, status=status.HTTP_200_OK)
+
+
+class ReferralLeaderboardView(APIView):
+    """
+    Requires user's JWT access token.
+    GET request: returns the top referrers ranked by the number of referrals,
+    either direct (?by=direct) or across the whole referral tree (?by=total, default).
+    ?limit=N sets the number of users returned.
+    """
+    permission_classes = [IsAuthenticated]
+    ranking_fields = {
+        'direct': 'direct_referrals_count',
+        'total': 'total_referrals_count',
+    }
+
+    def get(self, request, format=None):
+        ranking_field = self.ranking_fields.get(request.query_params.get('by', 'total'))
+        if ranking_field is None:
+            raise ValidationError({"by": "Ranking must be either 'direct' or 'total'."})
+        try:
+            limit = int(request.query_params.get('limit', LEADERBOARD_DEFAULT_SIZE))
+        except ValueError:
+            raise ValidationError({"limit": "Limit must be an integer."})
+        limit = min(max(limit, 1), LEADERBOARD_MAX_SIZE)
+
+        leaders = User.objects.filter(**{f'{ranking_field}__gt': 0}).order_by(f'-{ranking_field}', 'id').values(
+            'username', 'direct_referrals_count', 'total_referrals_count', user=F('id'))[:limit]
+        return Response(list(leaders), status=status.HTTP_200_OK)
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'referral_service.settings')
+# Every async request gets its own connection, so persistent connections
+# would only pile up; use DB_POOL_SIZE to avoid per-request connection setup.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
+
+from my_referrals.scheduler import install_sweeper  # noqa: E402
+
+install_sweeper()
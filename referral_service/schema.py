@@ -0,0 +1,20 @@
+from drf_yasg import openapi
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+
+api_info = openapi.Info(
+   title="Referral Code API",
+   default_version='v1',
+   description="The API allows users to generate and delete referral codes, register new users using referral codes, "
+               "get the list of referrals of each referrer, get referral code using the referrer's email.",
+   terms_of_service="https://www.google.com/policies/terms/",
+   contact=openapi.Contact(email="vlad89main@gmail.com"),
+   license=openapi.License(name="BSD License"),
+)
+
+schema_view = get_schema_view(
+   api_info,
+   public=True,
+   permission_classes=(permissions.AllowAny,),
+)
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'my_referrals.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +55,18 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-route latency, query count and DB time metrics, served at /metrics/ in
+# the Prometheus format (see my_referrals/metrics.py). Disabled, the middleware
+# drops out of the chain entirely.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '') == '1'
+
+# Bearer token letting scrapers read /metrics/, which otherwise requires the
+# JWT access token of a staff user (empty: staff only)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Also report request and DB time of every response in a Server-Timing header
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '') == '1'
+
 ROOT_URLCONF = 'referral_service.urls'
 
 TEMPLATES = [
@@ -92,12 +105,121 @@ DATABASES = {
     }
 }
 
+# DATABASE_ENGINE=sqlite runs the service (e.g. the loadtest command) against a
+# local SQLite file instead of MySQL.
+if os.environ.get('DATABASE_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+    }
+
+# Persistent connections: seconds a connection is kept open and reused by the
+# following requests of the same worker thread (0 closes it after every request,
+# 'none' never closes it). With health checks a reused connection is pinged
+# before its first query in a request, so a dropped connection is replaced
+# instead of failing the request.
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '60')
+DATABASES['default']['CONN_MAX_AGE'] = None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1'
+
+# DB_POOL_SIZE > 0 switches MySQL to a backend keeping up to that many idle
+# connections per process and handing them to new requests, which also works
+# under ASGI where persistent connections can't be used. Pooled connections are
+# replaced after DB_POOL_MAX_LIFETIME seconds.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+if DB_POOL_SIZE > 0 and DATABASES['default']['ENGINE'] == 'django.db.backends.mysql':
+    DATABASES['default']['ENGINE'] = 'my_referrals.backends.mysql'
+    DATABASES['default']['POOL'] = {
+        'SIZE': DB_POOL_SIZE,
+        'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+    }
+
+# Comma-separated hosts of read replicas of the default database. Lookup
+# endpoints read from them; everything else uses the primary.
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['my_referrals.routers.ReplicaRouter']
+
+# How long reads concerning a user stay on the primary after the user registers
+# or changes their referral code, so they see their own writes.
+REPLICA_STICKINESS_SECONDS = int(os.environ.get('REPLICA_STICKINESS_SECONDS', 10))
+
+# Where drain_referral_events delivers referral events (e.g. a user registering
+# with a referral code). BACKEND is a class with a send(messages) method,
+# instantiated with OPTIONS.
+REFERRAL_EVENT_SINKS = [
+    {
+        'BACKEND': 'my_referrals.outbox.JSONLFileSink',
+        'OPTIONS': {'path': os.environ.get('REFERRAL_EVENTS_FILE', str(BASE_DIR / 'referral_events.jsonl'))},
+    },
+]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Read-through cache of referral code lookups (see my_referrals/cache.py)
+REFERRAL_CODE_CACHE = {
+    'ALIAS': 'default',
+    'TTL': int(os.environ.get('REFERRAL_CODE_CACHE_TTL', 300)),
+    'LOCAL_TTL': int(os.environ.get('REFERRAL_CODE_LOCAL_CACHE_TTL', 5)),
+    'LOCAL_MAX_SIZE': 10000,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
 AUTH_USER_MODEL = "my_referrals.User"
 
+# Format of new referral codes: "base32" (10 Crockford base32 characters plus a
+# check character) or "hex" (32 hex characters, the original format).
+REFERRAL_CODE_FORMAT = os.environ.get('REFERRAL_CODE_FORMAT', 'base32')
+
+# Purge expired referral codes every N seconds from a background thread of the
+# web workers, one worker per interval (0 disables it). Alternatively, schedule
+# the purge_expired_codes command, or run it with --every in a single process.
+REFERRAL_CODE_PURGE_INTERVAL = int(os.environ.get('REFERRAL_CODE_PURGE_INTERVAL', 0))
+
+
+# Password hashing (see my_referrals/hashers.py). The hasher of the selected tier
+# is used for new hashes; hashes made by the others are still accepted and are
+# upgraded transparently on the next successful login.
+PASSWORD_HASHING_TIERS = {
+    'pbkdf2': 'my_referrals.hashers.TunablePBKDF2PasswordHasher',
+    'scrypt': 'my_referrals.hashers.TunableScryptPasswordHasher',
+    'argon2': 'my_referrals.hashers.TunableArgon2PasswordHasher',
+}
+PASSWORD_HASHING_TIER = os.environ.get('PASSWORD_HASHING_TIER', 'pbkdf2')
+
+PASSWORD_HASHERS = [
+    PASSWORD_HASHING_TIERS[PASSWORD_HASHING_TIER],
+    *(hasher for tier, hasher in PASSWORD_HASHING_TIERS.items() if tier != PASSWORD_HASHING_TIER),
+]
+
+PASSWORD_HASHING = {
+    'PBKDF2_ITERATIONS': int(os.environ.get('PBKDF2_ITERATIONS', 720000)),
+    'SCRYPT_WORK_FACTOR': int(os.environ.get('SCRYPT_WORK_FACTOR', 2 ** 14)),
+    'ARGON2_TIME_COST': int(os.environ.get('ARGON2_TIME_COST', 2)),
+    'ARGON2_MEMORY_COST': int(os.environ.get('ARGON2_MEMORY_COST', 102400)),
+    'ARGON2_PARALLELISM': int(os.environ.get('ARGON2_PARALLELISM', 8)),
+    # The async login and register endpoints, and batch registration, run hashing
+    # on a bounded pool of POOL_SIZE workers: "thread", "process" or "" (the event
+    # loop's default executor, or inline for batch registration).
+    'OFFLOAD': os.environ.get('PASSWORD_HASHING_OFFLOAD', 'thread'),
+    'POOL_SIZE': int(os.environ.get('PASSWORD_HASHING_POOL_SIZE', 4)),
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -113,16 +235,54 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# "stateless" trusts the user id claim of the access token and does not load
+# the user on each request; "database" is simplejwt's default behaviour.
+JWT_AUTH_MODE = os.environ.get('JWT_AUTH_MODE', 'stateless')
+
+# In stateless mode, how long a user's active status is cached, in seconds.
+# 0 skips the check entirely and trusts the token until it expires.
+JWT_USER_ACTIVE_CACHE_TTL = int(os.environ.get('JWT_USER_ACTIVE_CACHE_TTL', 30))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'my_referrals.authentication.StatelessJWTAuthentication'
+        if JWT_AUTH_MODE == 'stateless' else
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # JSON is encoded and decoded with orjson when it is installed (pip install
+    # orjson), and with the json module otherwise.
+    'DEFAULT_RENDERER_CLASSES': [
+        'my_referrals.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
-    ]
+        'my_referrals.parsers.FastJSONParser',
+    ],
+    # Token bucket rates of the throttled endpoints: "N/period" allows bursts of
+    # N requests, refilled at N per period. Login and registration are limited
+    # per client IP, code lookups per user and per IP. An empty value
+    # disables the limit.
+    'DEFAULT_THROTTLE_RATES': {
+        'login': os.environ.get('THROTTLE_RATE_LOGIN', '30/min') or None,
+        'register': os.environ.get('THROTTLE_RATE_REGISTER', '20/min') or None,
+        'email_lookup': os.environ.get('THROTTLE_RATE_EMAIL_LOOKUP', '120/min') or None,
+        'batch_lookup': os.environ.get('THROTTLE_RATE_BATCH_LOOKUP', '60/min') or None,
+    },
+    # Number of proxies in front of the service, so the client IP is taken
+    # from X-Forwarded-For instead of the proxy's address.
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.environ.get('NUM_PROXIES') else None,
 }
 
 
+# OpenAPI schema
+# A schema pre-generated at build time (python manage.py generate_schema) is
+# served from this file at /swagger.json, and drf-yasg is not loaded at runtime.
+# When empty, drf-yasg generates the schema and caches it for
+# API_SCHEMA_CACHE_TIMEOUT seconds.
+API_SCHEMA_FILE = os.environ.get('API_SCHEMA_FILE', '')
+API_SCHEMA_CACHE_TIMEOUT = int(os.environ.get('API_SCHEMA_CACHE_TIMEOUT', 3600))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
@@ -0,0 +1,38 @@
+"""
+Lean settings for production API workers: DJANGO_SETTINGS_MODULE=referral_service.settings_production.
+
+The API authenticates with JWTs only, so the apps and middleware serving the
+admin and browser sessions (sessions, messages, CSRF, clickjacking protection,
+the admin itself) are dropped, and the OpenAPI schema is served from the file
+written by `manage.py generate_schema` at build time instead of drf-yasg.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'my_referrals.apps.MyReferralsConfig',
+    'rest_framework_simplejwt',
+]
+
+MIDDLEWARE = [
+    'my_referrals.metrics.RequestMetricsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    # No browsable API, which needs templates and sessions.
+    'DEFAULT_RENDERER_CLASSES': [
+        'my_referrals.renderers.FastJSONRenderer',
+    ],
+}
+
+API_SCHEMA_FILE = os.environ.get('API_SCHEMA_FILE', str(BASE_DIR / 'openapi.json'))
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'referral_service.settings')
 
 application = get_wsgi_application()
+
+from my_referrals.scheduler import install_sweeper  # noqa: E402
+
+install_sweeper()